@@ -0,0 +1,105 @@
+"""
+Measure export throughput and peak memory.
+
+    python benchmarks/export_benchmark.py --rows 200000
+
+A throwaway SQLite database is filled with ``--rows`` entries, then each
+strategy runs in a fresh interpreter so that the peak RSS it reports is
+its own:
+
+- ``stream``: :func:`pyramid_blogr.services.export.export_entries`
+- ``orm``: loading every ``BlogRecord`` through a session, for comparison
+
+"""
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def populate(url, rows, body_size):
+    from pyramid_blogr.models.blog_record import BlogRecord, make_slug
+    from pyramid_blogr.models.meta import Base
+
+    engine = sa.create_engine(url)
+    Base.metadata.create_all(engine)
+    body = u'x' * body_size
+    now = datetime.datetime.utcnow()
+    with engine.begin() as connection:
+        for start in range(0, rows, 10000):
+            connection.execute(BlogRecord.__table__.insert(), [
+                {'title': u'entry %d' % i, 'slug': make_slug(u'entry %d' % i),
+                 'body': body, 'created': now, 'edited': now}
+                for i in range(start, min(start + 10000, rows))])
+    engine.dispose()
+
+
+def run(strategy, url, format, output):
+    from pyramid_blogr.services.export import export_entries, EXPORT_COLUMNS
+    from pyramid_blogr.models.blog_record import BlogRecord
+
+    engine = sa.create_engine(url)
+    started = time.perf_counter()
+    rows = 0
+    with open(output, 'wb') as out:
+        if strategy == 'stream':
+            for chunk in export_entries(engine, format):
+                out.write(chunk)
+            with engine.connect() as connection:
+                rows = connection.execute(
+                    sa.select(sa.func.count()).select_from(
+                        BlogRecord.__table__)).scalar()
+        else:
+            session = sa.orm.Session(bind=engine)
+            query = session.query(BlogRecord).options(
+                sa.orm.undefer(BlogRecord.body)).order_by(BlogRecord.id)
+            for entry in query:
+                out.write(json.dumps(
+                    {name: str(getattr(entry, name))
+                     for name in EXPORT_COLUMNS}).encode('utf-8') + b'\n')
+                rows += 1
+            session.close()
+    elapsed = time.perf_counter() - started
+    print('%-6s %9d rows %10.0f rows/s  peak RSS %7.1f MB' % (
+        strategy, rows, rows / elapsed, peak_rss_mb()))
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--body-size', type=int, default=2000)
+    parser.add_argument('--format', default='ndjson')
+    parser.add_argument('--strategy', action='append',
+                        choices=['stream', 'orm'])
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+
+    if args.run:
+        run(args.run, 'sqlite:///' + args.db, args.format, os.devnull)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'export.sqlite')
+        populate('sqlite:///' + db, args.rows, args.body_size)
+        for strategy in args.strategy or ['stream', 'orm']:
+            subprocess.check_call([
+                sys.executable, __file__, '--run', strategy, '--db', db,
+                '--format', args.format])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Measure password verifications per second, per core.
+
+    python benchmarks/hashing_benchmark.py --rounds 535000 --seconds 5
+
+Verifications run back to back in 1, 2, ... ``--processes`` worker
+processes, the way :class:`pyramid_blogr.passwords.PasswordHasher` runs
+them with the process backend.  The per core figure is what one hashing
+worker can serve; it drops once the workers outnumber the cores.
+
+"""
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+
+def context(rounds):
+    from pyramid_blogr.passwords import (
+        blogger_pwd_context,
+        calibrated_context,
+        )
+
+    if rounds:
+        return calibrated_context(blogger_pwd_context, rounds)
+    return blogger_pwd_context
+
+
+def verify_for(rounds, password_hash, seconds):
+    verifier = context(rounds)
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        verifier.verify(u'benchmark', password_hash)
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rounds', type=int, default=0,
+                        help='hash rounds (default: passlib defaults)')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    password_hash = context(args.rounds).hash(u'benchmark')
+    print('%s, %d cores' % ('$'.join(password_hash.split('$')[:3]),
+                            os.cpu_count()))
+    print('%-10s %12s %12s' % ('processes', 'verify/s', 'per process'))
+    spawn = multiprocessing.get_context('spawn')
+    for processes in range(1, args.processes + 1):
+        with concurrent.futures.ProcessPoolExecutor(
+                processes, mp_context=spawn) as pool:
+            # start the workers before the clock does
+            list(pool.map(verify_for, [args.rounds] * processes,
+                          [password_hash] * processes, [0] * processes))
+            counts = list(pool.map(
+                verify_for, [args.rounds] * processes,
+                [password_hash] * processes, [args.seconds] * processes))
+        rate = sum(counts) / args.seconds
+        print('%-10d %12.1f %12.1f' % (processes, rate, rate / processes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure what pyramid_tm and pyramid_retry cost read-only requests.
+
+    python benchmarks/request_overhead_benchmark.py --requests 2000
+
+The same requests are made through the whole WSGI pipeline with
+``blogr.db.fast_path`` off, so that every request runs in a transaction
+and may be retried, and on, so that safe requests and static assets skip
+both.  The difference per request is the overhead the fast path removes.
+
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+PATHS = ('/', '/blog/1/entry-1', '/static/theme.css')
+
+
+def make_app(path, fast_path):
+    from pyramid_blogr import main
+
+    return main({}, **{
+        'sqlalchemy.url': 'sqlite:///' + path,
+        'blogr.db.fast_path': 'true' if fast_path else 'false',
+        'blogr.hashing.backend': 'inline',
+        # measure the pipeline rather than the caches
+        'blogr.fragment_cache.size': '0',
+        'blogr.response_cache.size': '0',
+    })
+
+
+def populate(path, entries):
+    from pyramid_blogr.models import get_engine, get_session_factory
+    from pyramid_blogr.models.blog_record import BlogRecord
+    from pyramid_blogr.models.meta import Base
+
+    engine = get_engine({'sqlalchemy.url': 'sqlite:///' + path})
+    Base.metadata.create_all(engine)
+    session = get_session_factory(engine)()
+    for i in range(1, entries + 1):
+        entry = BlogRecord(title=u'entry %d' % i, body=u'*body* %d' % i)
+        entry.render_body()
+        session.add(entry)
+    session.commit()
+    session.close()
+    engine.dispose()
+
+
+def time_requests(app, path, requests):
+    from webob import Request
+
+    # warm up the app and its connections first
+    for i in range(10):
+        Request.blank(path).get_response(app)
+    started = time.perf_counter()
+    for i in range(requests):
+        response = Request.blank(path).get_response(app)
+        assert response.status_int == 200, (path, response.status)
+    return (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--entries', type=int, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'bench.sqlite')
+        populate(path, args.entries)
+        apps = [make_app(path, fast_path) for fast_path in (False, True)]
+        print('%-20s %14s %14s %14s' % (
+            'path', 'tm+retry us', 'fast path us', 'saved us'))
+        for url in PATHS:
+            slow, fast = [time_requests(app, url, args.requests) * 1e6
+                          for app in apps]
+            print('%-20s %14.1f %14.1f %14.1f' % (url, slow, fast,
+                                                   slow - fast))
+        for app in apps:
+            app.registry['dbsession_factory'].kw['bind'].dispose()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
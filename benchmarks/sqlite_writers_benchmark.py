@@ -0,0 +1,162 @@
+"""
+Measure write throughput with many concurrent writers to SQLite.
+
+    python benchmarks/sqlite_writers_benchmark.py --writers 16 64 --seconds 5
+
+Every writer thread runs transactions shaped like ``blog_update``: read an
+entry, then change it and post a new one, and take ``--hold`` ms more
+before committing, as ``pyramid_tm`` commits once the response is
+rendered.  Failed transactions are replayed up to ``--attempts`` times, as
+``pyramid_retry`` replays requests.
+
+Each writer count is run against two engines configured through the
+``sqlalchemy.*`` settings only, on the pragmas of ``production.ini``:
+
+- ``pooled``: a pool with a connection for every writer, so writers
+  collide on the SQLite lock and wait out ``busy_timeout``
+- ``serialized``: a pool of a single connection, so writers queue for it
+  in turn (``sqlalchemy.pool_size = 1``)
+
+Entries are picked with a seeded random generator (``--seed``), so runs
+on the same machine are comparable.
+
+"""
+import argparse
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError, TimeoutError
+
+MODES = ('pooled', 'serialized')
+
+
+def settings_for(path, mode, writers):
+    return {
+        'sqlalchemy.url': 'sqlite:///' + path,
+        'sqlalchemy.sqlite.busy_timeout': '5000',
+        'sqlalchemy.sqlite.journal_mode': 'wal',
+        'sqlalchemy.sqlite.synchronous': 'normal',
+        'sqlalchemy.sqlite.pool': 'queue',
+        'sqlalchemy.pool_size': str(writers if mode == 'pooled' else 1),
+        'sqlalchemy.max_overflow': '0',
+        'sqlalchemy.pool_timeout': '30',
+    }
+
+
+def populate(factory, entries):
+    from pyramid_blogr.models.blog_record import BlogRecord
+    from pyramid_blogr.models.meta import Base
+
+    session = factory()
+    Base.metadata.create_all(session.bind)
+    session.add_all(BlogRecord(title=u'entry %d' % i, body=u'body')
+                    for i in range(entries))
+    session.commit()
+    session.close()
+
+
+_titles = itertools.count()
+
+
+def update_entry(factory, entry_id, hold):
+    from pyramid_blogr.models.blog_record import BlogRecord
+
+    session = factory()
+    try:
+        entry = session.get(BlogRecord, entry_id)
+        entry.body = u'edited %f' % time.time()
+        session.add(BlogRecord(title=u'new entry %d' % next(_titles),
+                               body=u'body'))
+        session.flush()
+        time.sleep(hold)
+        session.commit()
+    finally:
+        session.close()
+
+
+def run(factory, writers, seconds, attempts, entries, hold, seed):
+    counts = {'committed': 0, 'replayed': 0, 'failed': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def writer(number):
+        pick = random.Random(seed + number)
+        committed = replayed = failed = 0
+        while time.perf_counter() < deadline:
+            entry_id = pick.randint(1, entries)
+            for attempt in range(attempts):
+                try:
+                    update_entry(factory, entry_id, hold)
+                except (OperationalError, TimeoutError):
+                    replayed += 1
+                else:
+                    committed += 1
+                    break
+            else:
+                failed += 1
+        with lock:
+            counts['committed'] += committed
+            # the last attempt of a failed transaction isn't replayed
+            counts['replayed'] += replayed - failed
+            counts['failed'] += failed
+
+    threads = [threading.Thread(target=writer, args=(i,))
+               for i in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counts['elapsed'] = time.perf_counter() - started
+    return counts
+
+
+def measure(mode, writers, args):
+    from pyramid_blogr.models import get_engine, get_session_factory
+
+    tmp = tempfile.mkdtemp()
+    try:
+        engine = get_engine(settings_for(
+            os.path.join(tmp, 'bench.sqlite'), mode, writers))
+        try:
+            factory = get_session_factory(engine)
+            populate(factory, args.entries)
+            return run(factory, writers, args.seconds, args.attempts,
+                       args.entries, args.hold / 1000.0, args.seed)
+        finally:
+            engine.dispose()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--writers', type=int, nargs='+', default=[16, 64])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--attempts', type=int, default=3,
+                        help='attempts per transaction (retry.attempts)')
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--hold', type=float, default=2.0,
+                        help='ms between writing and committing')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('%.1f s per run, %d attempts, %.1f ms hold, seed %d' % (
+        args.seconds, args.attempts, args.hold, args.seed))
+    print('%-8s %-11s %10s %10s %10s %10s' % (
+        'writers', 'mode', 'commits/s', 'committed', 'replayed', 'failed'))
+    for writers in args.writers:
+        for mode in MODES:
+            counts = measure(mode, writers, args)
+            print('%-8d %-11s %10.1f %10d %10d %10d' % (
+                writers, mode, counts['committed'] / counts['elapsed'],
+                counts['committed'], counts['replayed'], counts['failed']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,30 @@
 from pyramid.config import Configurator
-from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
 
+from .cache import LRUCache
+from .security import CachingAuthTktAuthenticationPolicy
+
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
-    authentication_policy = AuthTktAuthenticationPolicy('somesecret')
+    size = int(settings.get('blogr.ticket_cache.size', 1024))
+    ttl = int(settings.get('blogr.ticket_cache.ttl', 300))
+    ticket_cache = LRUCache(size, ttl=ttl or None) if size else None
+    authentication_policy = CachingAuthTktAuthenticationPolicy(
+        'somesecret', ticket_cache=ticket_cache)
     authorization_policy = ACLAuthorizationPolicy()
     with Configurator(settings=settings,
                       authentication_policy=authentication_policy,
                       authorization_policy=authorization_policy) as config:
         config.include('.models')
+        config.include('.services')
+        config.include('.passwords')
+        config.include('.throttle')
+        config.include('.security')
+        config.include('.querystats')
         config.include('pyramid_jinja2')
+        config.include('.cache')
         config.include('.routes')
         config.scan()
     return config.make_wsgi_app()
@@ -1,8 +1,8 @@
 """Pyramid bootstrap environment. """
 from alembic import context
 from pyramid.paster import get_appsettings, setup_logging
-from sqlalchemy import engine_from_config
 
+from pyramid_blogr.models import get_engine
 from pyramid_blogr.models.meta import Base
 
 config = context.config
@@ -13,6 +13,11 @@ settings = get_appsettings(config.config_file_name)
 target_metadata = Base.metadata
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    # the full-text index is a virtual table created by hand
+    return not (type_ == 'table' and name.startswith('entries_fts'))
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -37,12 +42,13 @@ def run_migrations_online():
     and associate a connection with the context.
 
     """
-    engine = engine_from_config(settings, prefix='sqlalchemy.')
+    engine = get_engine(settings)
 
     connection = engine.connect()
     context.configure(
         connection=connection,
-        target_metadata=target_metadata
+        target_metadata=target_metadata,
+        include_object=include_object,
     )
 
     try:
@@ -0,0 +1,22 @@
+"""index entries by creation date
+
+Revision ID: 3c1f0a9e7d42
+Revises: 5899f27f265f
+Create Date: 2026-10-18 09:12:41.503318
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f0a9e7d42'
+down_revision = '5899f27f265f'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index('ix_entries_created_id', 'entries', ['created', 'id'],
+                    unique=False)
+
+def downgrade():
+    op.drop_index('ix_entries_created_id', table_name='entries')
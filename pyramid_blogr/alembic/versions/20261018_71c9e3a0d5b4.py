@@ -0,0 +1,29 @@
+"""rendered HTML of entry bodies
+
+Revision ID: 71c9e3a0d5b4
+Revises: b5e0c2f81a37
+Create Date: 2026-10-18 16:02:11.503318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '71c9e3a0d5b4'
+down_revision = 'b5e0c2f81a37'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # existing entries are left unrendered; they are rendered when first
+    # viewed, or all at once with blogr_rerender
+    op.add_column('entries', sa.Column('body_html', sa.UnicodeText(),
+                                       nullable=True))
+    op.add_column('entries', sa.Column('body_html_version', sa.Integer(),
+                                       nullable=True))
+
+def downgrade():
+    with op.batch_alter_table('entries') as batch_op:
+        batch_op.drop_column('body_html_version')
+        batch_op.drop_column('body_html')
@@ -0,0 +1,81 @@
+"""store entry slugs
+
+Revision ID: 8a2d4c6b1e90
+Revises: 3c1f0a9e7d42
+Create Date: 2026-10-18 11:02:17.291604
+
+"""
+import re
+from urllib.parse import unquote
+
+from alembic import op
+import sqlalchemy as sa
+from webhelpers2.text import urlify
+
+
+# revision identifiers, used by Alembic.
+revision = '8a2d4c6b1e90'
+down_revision = '3c1f0a9e7d42'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def make_slug(title):
+    # pyramid_blogr.models.blog_record.make_slug as of this revision; the
+    # backfill must not change when the application's version does
+    if title is None:
+        return None
+    slug = urlify(title)
+    if len(slug) > 255:
+        # urlify percent-encodes non-ASCII characters, so trim back to the
+        # last complete one
+        slug = re.sub(r'%[0-9A-Fa-f]?$', '', slug[:255])
+        while True:
+            try:
+                unquote(slug, errors='strict')
+                break
+            except UnicodeDecodeError:
+                slug = slug[:-3]
+    return slug
+
+
+entries = sa.table(
+    'entries',
+    sa.column('id', sa.Integer),
+    sa.column('title', sa.Unicode),
+    sa.column('slug', sa.Unicode),
+)
+
+
+def upgrade():
+    op.add_column('entries', sa.Column('slug', sa.Unicode(length=255),
+                                       nullable=True))
+
+    # backfill existing rows in primary key order, one batch at a time
+    connection = op.get_bind()
+    update = entries.update().where(
+        entries.c.id == sa.bindparam('entry_id')).values(
+        slug=sa.bindparam('entry_slug'))
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(entries.c.id, entries.c.title)
+            .where(entries.c.id > last_id)
+            .order_by(entries.c.id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [
+            {'entry_id': row.id, 'entry_slug': make_slug(row.title)}
+            for row in rows])
+        last_id = rows[-1].id
+
+    op.create_index(op.f('ix_entries_slug'), 'entries', ['slug'],
+                    unique=False)
+
+def downgrade():
+    op.drop_index(op.f('ix_entries_slug'), table_name='entries')
+    with op.batch_alter_table('entries') as batch_op:
+        batch_op.drop_column('slug')
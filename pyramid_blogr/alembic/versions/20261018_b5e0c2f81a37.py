@@ -0,0 +1,28 @@
+"""full-text index of entries
+
+Revision ID: b5e0c2f81a37
+Revises: e47b9d03a615
+Create Date: 2026-10-18 15:20:36.847112
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e0c2f81a37'
+down_revision = 'e47b9d03a615'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("CREATE VIRTUAL TABLE entries_fts USING fts5("
+               "title, body, tokenize='unicode61 remove_diacritics 2')")
+    op.execute("INSERT INTO entries_fts (rowid, title, body) "
+               "SELECT id, title, body FROM entries")
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TABLE entries_fts")
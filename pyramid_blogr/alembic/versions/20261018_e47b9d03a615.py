@@ -0,0 +1,22 @@
+"""index entries by edit date
+
+Revision ID: e47b9d03a615
+Revises: 8a2d4c6b1e90
+Create Date: 2026-10-18 13:45:02.118730
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e47b9d03a615'
+down_revision = '8a2d4c6b1e90'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index(op.f('ix_entries_edited'), 'entries', ['edited'],
+                    unique=False)
+
+def downgrade():
+    op.drop_index(op.f('ix_entries_edited'), table_name='entries')
@@ -0,0 +1,223 @@
+import collections
+import threading
+import time
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from pyramid.response import Response
+from pyramid.tweens import INGRESS
+
+from .models.events import EntriesChanged
+from .routes import match_route
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping that holds at most ``maxsize`` items, dropping
+    the least recently used one to make room for a new one.
+
+    Items older than ``ttl`` seconds are treated as missing if a ``ttl`` is
+    given.  ``hits``, ``misses`` and ``evictions`` count how the cache has
+    been doing.
+
+    ``generation`` changes whenever items are discarded, so a value
+    computed from data that was invalidated in the meantime can be kept
+    out of the cache by passing the generation seen beforehand to
+    :meth:`set`.
+
+    """
+
+    def __init__(self, maxsize, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = self.misses = self.evictions = 0
+        self.generation = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and self.clock() >= expires:
+                del self._items[key]
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        expires = self.clock() + self.ttl if self.ttl else None
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, predicate):
+        """ Drop every item whose key satisfies ``predicate``. """
+        with self._lock:
+            self.generation += 1
+            for key in [key for key in self._items if predicate(key)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._items.clear()
+
+    def stats(self):
+        return {'size': len(self._items), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds a ``{% cache key, ... %}...{% endcache %}`` tag which renders its
+    body once and then serves the HTML from ``registry['fragment_cache']``
+    for as long as the key stays in the cache.
+
+    The key is the tuple of expressions given to the tag.  Fragments keyed
+    ``'entries', ...`` are dropped whenever any blog entry changes and
+    fragments keyed ``'entry', id, ...`` whenever that entry changes.
+    Those events only reach this process, so keys should also carry what
+    the fragment was rendered from, like the time an entry was edited, to
+    pick up changes made elsewhere.
+
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method(
+            '_render', [nodes.Tuple(key, 'load'), nodes.ContextReference()])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, key, context, caller):
+        request = context.get('request')
+        cache = request.registry.get('fragment_cache') if request else None
+        if cache is None:
+            return caller()
+        fragment = cache.get(key)
+        if fragment is None:
+            generation = cache.generation
+            fragment = caller()
+            cache.set(key, fragment, generation=generation)
+        return fragment
+
+
+def evict_entry_fragments(event):
+    cache = event.registry.get('fragment_cache')
+    if cache is None:
+        return
+    ids = event.ids
+    cache.discard(lambda key: key[0] == 'entries' or
+                  (key[0] == 'entry' and len(key) > 1 and key[1] in ids))
+
+
+#: routes whose anonymous GET responses may be kept by the response cache
+CACHED_ROUTES = ('home', 'blog')
+
+
+def response_cache_tween_factory(handler, registry):
+    """
+    Serve anonymous GET and HEAD requests on :data:`CACHED_ROUTES` from
+    ``registry['response_cache']``.
+
+    Hits are answered before the transaction manager or the database
+    session are involved.  Only complete ``200 OK`` responses which don't
+    set cookies are kept.
+
+    """
+    cache = registry.get('response_cache')
+    if cache is None:
+        return handler
+
+    def response_cache_tween(request):
+        if request.method not in ('GET', 'HEAD'):
+            return handler(request)
+        info = match_route(request)
+        route = info['route']
+        if route is None or route.name not in CACHED_ROUTES:
+            return handler(request)
+        # signed in users get personalised pages
+        if request.authenticated_userid is not None:
+            return handler(request)
+
+        key = (route.name, info['match'].get('id'), request.url)
+        cached = cache.get(key)
+        if cached is not None:
+            status, headerlist, body = cached
+            response = Response(status=status, headerlist=list(headerlist),
+                                body=body, conditional_response=True)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        generation = cache.generation
+        response = handler(request)
+        if (request.method == 'GET' and response.status_int == 200 and
+                'Set-Cookie' not in response.headers):
+            cache.set(key, (response.status, tuple(response.headerlist),
+                            response.body), generation=generation)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    return response_cache_tween
+
+
+def evict_entry_responses(event):
+    cache = event.registry.get('response_cache')
+    if cache is None:
+        return
+    ids = {str(_id) for _id in event.ids}
+    cache.discard(lambda key: key[0] == 'home' or key[1] in ids)
+
+
+def clear_feeds(event):
+    event.registry['feed_cache'].clear()
+
+
+def includeme(config):
+    """
+    Set up fragment caching for the Jinja2 templates, the response cache
+    for anonymous traffic and the cache of serialized feeds.
+
+    Activate this setup using ``config.include('pyramid_blogr.cache')``
+    after ``pyramid_jinja2``.
+
+    """
+    settings = config.get_settings()
+    size = int(settings.get('blogr.fragment_cache.size', 512))
+    ttl = int(settings.get('blogr.fragment_cache.ttl', 0))
+
+    config.add_jinja2_extension(FragmentCacheExtension)
+    if size:
+        config.registry['fragment_cache'] = LRUCache(size, ttl=ttl or None)
+        config.add_subscriber(evict_entry_fragments, EntriesChanged)
+
+    size = int(settings.get('blogr.response_cache.size', 0))
+    ttl = int(settings.get('blogr.response_cache.ttl', 0))
+    if size:
+        config.registry['response_cache'] = LRUCache(size, ttl=ttl or None)
+        config.add_subscriber(evict_entry_responses, EntriesChanged)
+        config.add_tween('pyramid_blogr.cache.response_cache_tween_factory',
+                         under=INGRESS)
+
+    # serialized feeds, one per host name the site is reached through
+    config.registry['feed_cache'] = LRUCache(8)
+    config.add_subscriber(clear_feeds, EntriesChanged)
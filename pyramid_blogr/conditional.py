@@ -0,0 +1,61 @@
+"""
+Helpers for answering conditional GET requests (``If-None-Match`` and
+``If-Modified-Since``) with ``304 Not Modified``.
+
+"""
+import collections
+import hashlib
+
+from pyramid.httpexceptions import HTTPNotModified
+from webob.datetime_utils import UTC
+
+Validators = collections.namedtuple('Validators', 'etag last_modified')
+
+
+def make_validators(last_modified, *parts):
+    """
+    Return the :class:`Validators` of a representation last changed at
+    ``last_modified``, a naive UTC datetime, whose contents also depend on
+    ``parts``.
+
+    """
+    digest = hashlib.sha1(
+        repr((last_modified,) + parts).encode('utf-8')).hexdigest()
+    if last_modified is not None:
+        # HTTP dates have a resolution of one second
+        last_modified = last_modified.replace(microsecond=0, tzinfo=UTC)
+    return Validators(digest, last_modified)
+
+
+def is_conditional(request):
+    return ('If-None-Match' in request.headers or
+            'If-Modified-Since' in request.headers)
+
+
+def is_fresh(request, validators):
+    """
+    Tell whether the copy the client already has matches ``validators``.
+
+    """
+    if 'If-None-Match' in request.headers:
+        # If-Modified-Since is ignored when an ETag was sent
+        return validators.etag in request.if_none_match
+    if 'If-Modified-Since' in request.headers:
+        since = request.if_modified_since
+        return bool(since and validators.last_modified and
+                    validators.last_modified <= since)
+    return False
+
+
+def set_validators(response, validators, vary=()):
+    response.etag = validators.etag
+    if validators.last_modified is not None:
+        response.last_modified = validators.last_modified
+    if vary:
+        response.vary = tuple(
+            sorted(set(response.vary or ()) | set(vary)))
+    return response
+
+
+def not_modified(validators, vary=()):
+    return set_validators(HTTPNotModified(), validators, vary)
@@ -0,0 +1,69 @@
+"""
+Markdown rendering of entry bodies.
+
+Rendering is done once, when an entry is written, and the HTML is stored
+next to the source along with the :data:`RENDERER_VERSION` it was made
+with.  Bump the version whenever the output of :func:`render` changes so
+existing entries are picked up as stale.
+
+"""
+import html
+import re
+import threading
+
+import markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+RENDERER_VERSION = 1
+
+#: URL schemes links and images may point to; relative URLs are allowed
+SAFE_SCHEMES = ('http', 'https', 'mailto')
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'sane_lists']
+
+
+class _SafeURLs(Treeprocessor):
+
+    def run(self, root):
+        for element in root.iter():
+            for attribute in ('href', 'src'):
+                url = element.get(attribute)
+                if url is not None and not _is_safe(url):
+                    del element.attrib[attribute]
+
+
+def _is_safe(url):
+    # browsers decode entities and ignore whitespace and control characters
+    # before they look at the scheme
+    url = re.sub(r'[\x00-\x20]', '', html.unescape(url))
+    match = re.match(r'([^/?#]*):', url)
+    return match is None or match.group(1).lower() in SAFE_SCHEMES
+
+
+class SafeMarkdown(Extension):
+    """
+    Escapes raw HTML instead of passing it through, and drops links to
+    URL schemes other than :data:`SAFE_SCHEMES`.
+
+    """
+
+    def extendMarkdown(self, md):
+        md.preprocessors.deregister('html_block')
+        md.inlinePatterns.deregister('html')
+        md.treeprocessors.register(_SafeURLs(md), 'safe_urls', 0)
+
+
+_local = threading.local()
+
+
+def render(source):
+    """ Return the HTML for the Markdown ``source`` of an entry body. """
+    md = getattr(_local, 'markdown', None)
+    if md is None:
+        md = _local.markdown = markdown.Markdown(
+            extensions=MARKDOWN_EXTENSIONS + [SafeMarkdown()])
+    try:
+        return md.convert(source or u'')
+    finally:
+        md.reset()
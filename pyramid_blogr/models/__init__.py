@@ -1,4 +1,6 @@
+from pyramid.settings import asbool, aslist
 from sqlalchemy import engine_from_config
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import configure_mappers
 import zope.sqlalchemy
@@ -7,6 +9,12 @@ import zope.sqlalchemy
 # Base.metadata prior to any initialization routines
 from .user import User
 from .blog_record import BlogRecord
+from .events import track_entry_changes
+from . import search  # keeps the full-text index in step with entries
+from . import sqlite
+from .. import querystats
+from .readonly import READ_ONLY_KEY, get_read_only_session
+from .replicas import Replicas
 
 # run configure_mappers after defining all of the models to ensure
 # all relationships can be setup
@@ -14,7 +22,42 @@ configure_mappers()
 
 
 def get_engine(settings, prefix='sqlalchemy.'):
-    return engine_from_config(settings, prefix)
+    settings = dict(settings)
+    # sqlalchemy.sqlite.* are ours, not create_engine() arguments
+    pragmas, engine_kw = sqlite.pop_settings(settings, prefix)
+    if make_url(settings[prefix + 'url']).get_backend_name() != 'sqlite':
+        pragmas, engine_kw = [], {}
+    engine = engine_from_config(settings, prefix, **engine_kw)
+    sqlite.set_pragmas(engine, pragmas)
+    querystats.instrument(engine)
+    return engine
+
+
+def get_read_only_engine(settings, url, prefix='sqlalchemy.'):
+    """
+    Return an engine for the read-only database ``url``, configured like
+    the primary one otherwise.
+
+    """
+    settings = dict(settings)
+    settings[prefix + 'url'] = url
+    # only the primary can switch the journal mode
+    settings.pop(prefix + 'sqlite.journal_mode', None)
+    return get_engine(settings, prefix)
+
+
+def get_replica_engines(settings, prefix='sqlalchemy.'):
+    """
+    Return engines for the ``blogr.db.replicas`` URLs, where ``read_only``
+    stands for read-only connections to the primary SQLite file.
+
+    """
+    engines = []
+    for url in aslist(settings.get('blogr.db.replicas', '')):
+        if url == 'read_only':
+            url = sqlite.read_only_url(settings[prefix + 'url'])
+        engines.append(get_read_only_engine(settings, url, prefix))
+    return engines
 
 
 def get_session_factory(engine):
@@ -60,6 +103,18 @@ def includeme(config):
     settings = config.get_settings()
     settings['tm.manager_hook'] = 'pyramid_tm.explicit_manager'
 
+    # safe requests which only read skip pyramid_tm and pyramid_retry
+    if asbool(settings.get('blogr.db.fast_path', False)):
+        settings['blogr.db.read_only_routes'] = frozenset(aslist(
+            settings.get('blogr.db.read_only_routes',
+                         'home blog feed search')))
+        settings.setdefault(
+            'tm.activate_hook',
+            'pyramid_blogr.models.readonly.tm_activate_hook')
+        settings.setdefault(
+            'retry.activate_hook',
+            'pyramid_blogr.models.readonly.retry_activate_hook')
+
     # use pyramid_tm to hook the transaction lifecycle to the request
     config.include('pyramid_tm')
 
@@ -69,10 +124,31 @@ def includeme(config):
     session_factory = get_session_factory(get_engine(settings))
     config.registry['dbsession_factory'] = session_factory
 
-    # make request.dbsession available for use in Pyramid
+    # let subscribers know when committed transactions touched entries
+    track_entry_changes(session_factory, config.registry)
+
+    # safe requests may read from replicas instead
+    replicas = Replicas(
+        session_factory,
+        [sessionmaker(bind=engine, info={READ_ONLY_KEY: True})
+         for engine in get_replica_engines(settings)],
+        routes=aslist(settings.get('blogr.db.replica_routes',
+                                   'home blog feed')),
+        sticky=int(settings.get('blogr.db.sticky_seconds', 10)))
+    config.registry['dbsession_replicas'] = replicas
     config.add_request_method(
-        # r.tm is the transaction manager used by pyramid_tm
-        lambda r: get_tm_session(session_factory, r.tm),
-        'dbsession',
+        lambda r: r.registry['dbsession_replicas'].factory_for(r),
+        'dbsession_factory',
         reify=True
     )
+
+    # make request.dbsession available for use in Pyramid
+    config.add_request_method(get_request_dbsession, 'dbsession', reify=True)
+
+
+def get_request_dbsession(request):
+    if request.environ.get('blogr.read_only'):
+        # pyramid_tm left this request alone
+        return get_read_only_session(request.dbsession_factory, request)
+    # request.tm is the transaction manager used by pyramid_tm
+    return get_tm_session(request.dbsession_factory, request.tm)
@@ -1,4 +1,6 @@
 import datetime #<- will be used to set default dates on models
+import re
+from urllib.parse import unquote
 from pyramid_blogr.models.meta import Base  #<- we need to import our sqlalchemy metadata from which model classes will inherit
 from sqlalchemy import (
     Column,
@@ -6,22 +8,59 @@ from sqlalchemy import (
     Unicode,     #<- will provide Unicode field
     UnicodeText, #<- will provide Unicode text field
     DateTime,    #<- time abstraction field
+    Index,       #<- lets listings walk entries in date order
 )
+from sqlalchemy.orm import deferred #<- loads a column only when it is used
+from sqlalchemy.orm import validates #<- keeps the slug in step with the title
 from webhelpers2.text import urlify #<- will generate slugs
 from webhelpers2.date import distance_of_time_in_words #<- human friendly dates
+from ..markup import RENDERER_VERSION, render
+
+
+def make_slug(title):
+    if title is None:
+        return None
+    slug = urlify(title)
+    if len(slug) > 255:
+        # urlify percent-encodes non-ASCII characters, so trim back to the
+        # last complete one
+        slug = re.sub(r'%[0-9A-Fa-f]?$', '', slug[:255])
+        while True:
+            try:
+                unquote(slug, errors='strict')
+                break
+            except UnicodeDecodeError:
+                slug = slug[:-3]
+    return slug
 
 
 class BlogRecord(Base):
     __tablename__ = 'entries'
+    __table_args__ = (
+        Index('ix_entries_created_id', 'created', 'id'),
+    )
     id = Column(Integer, primary_key=True)
     title = Column(Unicode(255), unique=True, nullable=False)
-    body = Column(UnicodeText, default=u'')
+    slug = Column(Unicode(255), index=True)
+    body = deferred(Column(UnicodeText, default=u''), group='body')
+    body_html = deferred(Column(UnicodeText), group='body')
+    body_html_version = deferred(Column(Integer), group='body')
     created = Column(DateTime, default=datetime.datetime.utcnow)
-    edited = Column(DateTime, default=datetime.datetime.utcnow)
+    edited = Column(DateTime, default=datetime.datetime.utcnow,
+                    onupdate=datetime.datetime.utcnow, index=True)
+
+    @validates('title')
+    def update_slug(self, key, title):
+        self.slug = make_slug(title)
+        return title
 
     @property
-    def slug(self):
-        return urlify(self.title)
+    def body_html_stale(self):
+        return self.body_html_version != RENDERER_VERSION
+
+    def render_body(self):
+        self.body_html = render(self.body)
+        self.body_html_version = RENDERER_VERSION
 
     @property
     def created_in_words(self):
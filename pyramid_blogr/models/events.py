@@ -0,0 +1,57 @@
+from sqlalchemy import event
+
+from .blog_record import BlogRecord
+
+CHANGES_KEY = 'blogr.entry_changes'
+
+
+class EntriesChanged(object):
+    """
+    Sent through the registry after a transaction that inserted, updated
+    or deleted blog entries has been committed.
+
+    ``inserted``, ``updated`` and ``deleted`` are sets of entry ids.
+
+    """
+
+    def __init__(self, registry, inserted, updated, deleted):
+        self.registry = registry
+        self.inserted = inserted
+        self.updated = updated
+        self.deleted = deleted
+
+    @property
+    def ids(self):
+        return self.inserted | self.updated | self.deleted
+
+
+def track_entry_changes(session_factory, registry):
+    """
+    Notify :class:`EntriesChanged` subscribers about blog entries written
+    by sessions created from ``session_factory``.
+
+    """
+
+    @event.listens_for(session_factory, 'after_flush')
+    def collect_changes(session, flush_context):
+        inserted, updated, deleted = session.info.setdefault(
+            CHANGES_KEY, (set(), set(), set()))
+        for obj in session.new:
+            if isinstance(obj, BlogRecord):
+                inserted.add(obj.id)
+        for obj in session.dirty:
+            if isinstance(obj, BlogRecord) and session.is_modified(obj):
+                updated.add(obj.id)
+        for obj in session.deleted:
+            if isinstance(obj, BlogRecord):
+                deleted.add(obj.id)
+
+    @event.listens_for(session_factory, 'after_commit')
+    def notify_changes(session):
+        changes = session.info.pop(CHANGES_KEY, None)
+        if changes and any(changes):
+            registry.notify(EntriesChanged(registry, *changes))
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def forget_changes(session):
+        session.info.pop(CHANGES_KEY, None)
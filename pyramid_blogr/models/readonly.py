@@ -0,0 +1,65 @@
+"""
+A fast path for requests which only read.
+
+``pyramid_tm`` begins and commits a transaction around every request and
+``pyramid_retry`` makes every request body seekable so it can be replayed,
+whether or not the request touches the database.  With ``blogr.db.fast_path``
+on, ``GET`` and ``HEAD`` requests to the routes in
+``blogr.db.read_only_routes`` skip both: their ``request.dbsession`` is a
+plain session which refuses to flush and is closed when the request is
+finished.  Static assets always skip both.  What such a request must
+still write, like the HTML of an entry rendered again on view, goes
+through a short transaction of its own.
+
+"""
+from sqlalchemy import event
+from sqlalchemy.exc import InvalidRequestError
+
+from ..routes import match_route
+
+#: ``session.info`` flag of sessions which can't write
+READ_ONLY_KEY = 'blogr.read_only'
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+_ENVIRON_KEY = 'blogr.read_only'
+
+
+def is_read_only(request):
+    """ Return whether ``request`` takes the read-only fast path. """
+    environ = request.environ
+    if _ENVIRON_KEY not in environ:
+        route = match_route(request)['route']
+        settings = request.registry.settings
+        environ[_ENVIRON_KEY] = route is not None and (
+            # static views
+            route.name.startswith('__') or
+            request.method in SAFE_METHODS and
+            route.name in settings['blogr.db.read_only_routes'])
+    return environ[_ENVIRON_KEY]
+
+
+def tm_activate_hook(request):
+    """ ``tm.activate_hook`` leaving read-only requests alone. """
+    return not is_read_only(request)
+
+
+def retry_activate_hook(request):
+    """ ``retry.activate_hook`` trying read-only requests only once. """
+    return 1 if is_read_only(request) else None
+
+
+def _refuse_flush(session, flush_context, instances):
+    raise InvalidRequestError('read-only session can not flush')
+
+
+def get_read_only_session(session_factory, request):
+    """
+    Return a session of ``session_factory`` which can't write, closed
+    when ``request`` is finished.
+
+    """
+    dbsession = session_factory(info={READ_ONLY_KEY: True})
+    event.listen(dbsession, 'before_flush', _refuse_flush)
+    request.add_finished_callback(lambda request: dbsession.close())
+    return dbsession
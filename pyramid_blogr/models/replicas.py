@@ -0,0 +1,72 @@
+"""
+Read replicas for safe requests.
+
+``blogr.db.replicas`` lists databases holding copies of the primary one:
+replica URLs, or ``read_only`` for read-only connections to the primary
+SQLite file.  ``GET`` and ``HEAD`` requests to the routes listed in
+``blogr.db.replica_routes`` read from one of them; everything else,
+``blog_action`` included, uses the primary.
+
+Replicas lag behind the primary, so a client keeps using the primary for
+``blogr.db.sticky_seconds`` after one of its requests wrote there, for as
+long as the :data:`STICKY_COOKIE` it is given lasts.
+
+"""
+import random
+
+from sqlalchemy import event
+
+STICKY_COOKIE = 'blogr_primary'
+
+WROTE_KEY = 'blogr.wrote'
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def track_writes(session_factory):
+    """ Flag the sessions of ``session_factory`` which wrote something. """
+
+    @event.listens_for(session_factory, 'after_flush')
+    def wrote(session, flush_context):
+        session.info[WROTE_KEY] = True
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def rolled_back(session):
+        session.info.pop(WROTE_KEY, None)
+
+
+class Replicas(object):
+    """
+    Picks the session factory for a request: one of the replica
+    ``factories`` for safe requests to ``routes``, ``primary`` otherwise.
+
+    """
+
+    def __init__(self, primary, factories, routes=('home', 'blog', 'feed'),
+                 sticky=10):
+        self.primary = primary
+        self.factories = factories
+        self.routes = frozenset(routes)
+        self.sticky = sticky
+        track_writes(primary)
+
+    def use_replica(self, request):
+        route = request.matched_route
+        return (request.method in SAFE_METHODS and
+                route is not None and route.name in self.routes and
+                STICKY_COOKIE not in request.cookies)
+
+    def factory_for(self, request):
+        if not self.factories:
+            return self.primary
+        if self.use_replica(request):
+            return random.choice(self.factories)
+        request.add_response_callback(self._stick)
+        return self.primary
+
+    def _stick(self, request, response):
+        session = request.__dict__.get('dbsession')
+        if session is not None and session.info.get(WROTE_KEY):
+            response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky,
+                                httponly=True)
+
@@ -0,0 +1,73 @@
+"""
+SQLite FTS5 full-text index over entry titles and bodies.
+
+The ``entries_fts`` virtual table keeps its own copy of the indexed text,
+keyed by entry id through its ``rowid``.  Mapper events keep it in step
+with ORM writes; Core bulk writes call :func:`index_new_entries`
+themselves.
+
+"""
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.schema import DDL
+
+from .blog_record import BlogRecord
+
+FTS_TABLE = 'entries_fts'
+
+CREATE_FTS_TABLE = (
+    "CREATE VIRTUAL TABLE entries_fts USING fts5("
+    "title, body, tokenize='unicode61 remove_diacritics 2')")
+DROP_FTS_TABLE = 'DROP TABLE IF EXISTS entries_fts'
+
+_delete = sa.text('DELETE FROM entries_fts WHERE rowid = :id')
+_insert = sa.text(
+    'INSERT INTO entries_fts (rowid, title, body) '
+    'SELECT id, title, body FROM entries WHERE id = :id')
+
+
+def _enabled(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def index_entries(connection, ids):
+    """ (Re)index the entries ``ids`` from their stored rows. """
+    if ids and _enabled(connection):
+        params = [{'id': _id} for _id in ids]
+        connection.execute(_delete, params)
+        connection.execute(_insert, params)
+
+
+def unindex_entries(connection, ids):
+    if ids and _enabled(connection):
+        connection.execute(_delete, [{'id': _id} for _id in ids])
+
+
+def index_new_entries(connection, ids):
+    """ Index the entries ``ids``, inserted without the ORM. """
+    if ids and _enabled(connection):
+        connection.execute(_insert, [{'id': _id} for _id in ids])
+
+
+@event.listens_for(BlogRecord, 'after_insert')
+def _entry_inserted(mapper, connection, target):
+    index_entries(connection, [target.id])
+
+
+@event.listens_for(BlogRecord, 'after_update')
+def _entry_updated(mapper, connection, target):
+    state = sa.inspect(target)
+    if (state.attrs.title.history.has_changes() or
+            state.attrs.body.history.has_changes()):
+        index_entries(connection, [target.id])
+
+
+@event.listens_for(BlogRecord, 'after_delete')
+def _entry_deleted(mapper, connection, target):
+    unindex_entries(connection, [target.id])
+
+
+event.listen(BlogRecord.__table__, 'after_create',
+             DDL(CREATE_FTS_TABLE).execute_if(dialect='sqlite'))
+event.listen(BlogRecord.__table__, 'before_drop',
+             DDL(DROP_FTS_TABLE).execute_if(dialect='sqlite'))
@@ -0,0 +1,110 @@
+"""
+Connection setup for SQLite databases.
+
+``sqlalchemy.sqlite.<pragma>`` settings are run as ``PRAGMA`` statements
+on every new connection, for example::
+
+    sqlalchemy.sqlite.journal_mode = wal
+    sqlalchemy.sqlite.synchronous = normal
+    sqlalchemy.sqlite.busy_timeout = 5000
+
+and ``sqlalchemy.sqlite.pool`` picks the connection pool, one of
+:data:`POOLS`.  They are taken out of the settings before the engine is
+created, and ignored for other databases.
+
+"""
+import re
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool
+from sqlalchemy.pool import StaticPool
+
+#: pragmas which may be set, in the order they are run; the busy timeout
+#: comes first so that switching the journal mode waits for other
+#: connections
+PRAGMAS = (
+    'busy_timeout',
+    'journal_mode',
+    'synchronous',
+    'cache_size',
+    'mmap_size',
+    'temp_store',
+    'wal_autocheckpoint',
+    'foreign_keys',
+)
+
+POOLS = {
+    'queue': QueuePool,
+    'null': NullPool,
+    'singleton': SingletonThreadPool,
+    'static': StaticPool,
+}
+
+_VALUE = re.compile(r'^-?\w+$')
+
+
+def pop_settings(settings, prefix='sqlalchemy.'):
+    """
+    Remove the ``sqlite.*`` options from ``settings``.
+
+    Returns the pragmas to run, as ``(name, value)`` pairs, and the keyword
+    arguments they add to :func:`sqlalchemy.engine_from_config`.
+
+    """
+    prefix += 'sqlite.'
+    options = {}
+    for key in [key for key in settings if key.startswith(prefix)]:
+        options[key[len(prefix):]] = str(settings.pop(key)).strip()
+
+    engine_kw = {}
+    pool = options.pop('pool', None)
+    if pool:
+        try:
+            engine_kw['poolclass'] = POOLS[pool]
+        except KeyError:
+            raise ValueError('unknown sqlite pool %r, use one of %s'
+                             % (pool, ', '.join(sorted(POOLS))))
+
+    unknown = set(options) - set(PRAGMAS)
+    if unknown:
+        raise ValueError('unknown sqlite pragmas: %s'
+                         % ', '.join(sorted(unknown)))
+    pragmas = []
+    for name in PRAGMAS:
+        if name in options:
+            if not _VALUE.match(options[name]):
+                raise ValueError('bad value for sqlite pragma %s: %r'
+                                 % (name, options[name]))
+            pragmas.append((name, options[name]))
+    return pragmas, engine_kw
+
+
+def set_pragmas(engine, pragmas):
+    """ Run ``pragmas`` on every connection ``engine`` opens. """
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute('PRAGMA %s = %s' % (name, value))
+        finally:
+            cursor.close()
+
+
+def read_only_url(url):
+    """
+    Return the URL of a read-only connection to the SQLite file ``url``.
+
+    """
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite':
+        raise ValueError('%s is not a SQLite database' % (url,))
+    if url.database in (None, '', ':memory:') or \
+            url.database.startswith('file:'):
+        raise ValueError('%s is not a SQLite file' % (url,))
+    return url.set(database='file:' + url.database,
+                   query=dict(url.query, mode='ro', uri='true'))
@@ -8,7 +8,7 @@ from sqlalchemy import (
     DateTime,    #<- time abstraction field
 )
 
-from passlib.apps import custom_app_context as blogger_pwd_context
+from ..passwords import inline_hasher
 
 
 class User(Base):
@@ -18,13 +18,27 @@ class User(Base):
     password = Column(Unicode(255), nullable=False)
     last_logged = Column(DateTime, default=datetime.datetime.utcnow)
 
-    def verify_password(self, password):
+    def verify_password(self, password, hasher=None):
+        hasher = hasher or inline_hasher
         # is it cleartext?
-        if password == self.password:
-            self.set_password(password)
+        if hasher.cleartext and password == self.password:
+            # hashing it is all the work there is to do
+            self.set_password(password, hasher)
+            return True
 
-        return blogger_pwd_context.verify(password, self.password)
+        try:
+            valid, new_hash = hasher.verify_and_update(password,
+                                                       self.password)
+        except ValueError:
+            # not a hash at all, e.g. a cleartext password not yet hashed
+            # by blogr_hash_passwords
+            return False
+        if new_hash is not None:
+            # hashed with fewer rounds than we use now
+            self.password = new_hash
+        return valid
 
-    def set_password(self, password):
-        password_hash = blogger_pwd_context.encrypt(password)
+    def set_password(self, password, hasher=None):
+        hasher = hasher or inline_hasher
+        password_hash = hasher.hash(password)
         self.password = password_hash
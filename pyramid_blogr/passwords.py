@@ -0,0 +1,221 @@
+"""
+Password hashing off the request threads.
+
+Hashing and verifying passwords is deliberately expensive, so a burst of
+sign ins would keep every worker thread of the server busy and stall
+everybody else.  :class:`PasswordHasher` runs that work on an executor of
+its own, holds at most ``workers + queue_size`` operations at once and
+raises :class:`HashingBusy` straight away beyond that, which is answered
+with ``503 Service Unavailable``.
+
+The request thread still waits for its operation, so each pending one
+occupies a server thread.  Only with ``workers + queue_size`` below the
+server's thread count (``threads`` of waitress, 4 by default) are some
+threads always left for requests which don't hash.
+
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+import time
+
+from passlib.apps import custom_app_context as blogger_pwd_context
+from passlib.context import CryptContext
+from passlib.registry import get_crypt_handler
+from pyramid.settings import asbool
+
+log = logging.getLogger(__name__)
+
+BACKENDS = ('process', 'thread', 'inline')
+
+
+class HashingBusy(Exception):
+    """ Raised when too many password operations are already queued. """
+
+
+_contexts = {}
+
+
+def _context(policy):
+    # contexts are handed to worker processes as their serialized policy
+    context = _contexts.get(policy)
+    if context is None:
+        context = _contexts[policy] = CryptContext.from_string(policy)
+    return context
+
+
+def call_context(policy, method, *args):
+    """
+    Call ``method`` of the passlib context serialized as ``policy``; the
+    pickleable way of handing hashing work to another process.
+
+    """
+    return getattr(_context(policy), method)(*args)
+
+
+class PasswordHasher(object):
+    """
+    Runs the hashing methods of a passlib ``context`` on a bounded
+    executor.
+
+    The ``process`` backend sidesteps the GIL, ``thread`` only helps with
+    hash backends that release it and ``inline`` runs everything in the
+    calling thread, as if there were no hasher.
+
+    ``cleartext`` lets users whose password is still stored in cleartext
+    sign in, hashing it on the way.  Use :meth:`verify_and_update` to
+    also replace hashes weaker than the context asks for.
+
+    """
+
+    def __init__(self, context=blogger_pwd_context, backend='process',
+                 workers=2, queue_size=0, cleartext=False):
+        if backend not in BACKENDS:
+            raise ValueError('unknown hashing backend %r' % backend)
+        self.context = context
+        self.backend = backend
+        self.workers = workers
+        self.cleartext = cleartext
+        self.limit = workers + queue_size
+        #: operations running or waiting for a worker
+        self.pending = 0
+        self._policy = context.to_string()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.backend == 'process':
+                    # a fresh interpreter rather than a fork of a threaded
+                    # server
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        self.workers,
+                        mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        self.workers, thread_name_prefix='hasher')
+            return self._executor
+
+    def _run(self, method, *args):
+        if self.backend == 'inline':
+            return getattr(self.context, method)(*args)
+        executor = self._get_executor()
+        with self._lock:
+            if self.pending >= self.limit:
+                raise HashingBusy()
+            self.pending += 1
+        try:
+            return executor.submit(call_context, self._policy, method,
+                                   *args).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def hash(self, password):
+        return self._run('hash', password)
+
+    def verify(self, password, password_hash):
+        return self._run('verify', password, password_hash)
+
+    def verify_and_update(self, password, password_hash):
+        """
+        Return whether ``password`` matches and the hash to store instead
+        of ``password_hash``, ``None`` if it is good as it is.
+
+        """
+        return self._run('verify_and_update', password, password_hash)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def calibrate_rounds(context=blogger_pwd_context, target=0.35, samples=3,
+                     timer=time.perf_counter):
+    """
+    Return the number of rounds of the default scheme of ``context``
+    which takes about ``target`` seconds to hash or verify a password on
+    this machine.
+
+    """
+    scheme = get_crypt_handler(context.default_scheme())
+    probe_rounds = max(scheme.min_rounds, scheme.default_rounds // 8)
+    probe = scheme.using(rounds=probe_rounds)
+    elapsed = []
+    for i in range(samples):
+        started = timer()
+        probe.hash(u'calibration')
+        elapsed.append(timer() - started)
+    # the cost grows linearly with rounds; the quickest run is the one
+    # least disturbed by everything else going on
+    rounds = int(probe_rounds * target / max(min(elapsed), 1e-6))
+    return max(scheme.min_rounds, min(scheme.max_rounds, rounds))
+
+
+def calibrated_context(context, rounds, tolerance=0.25):
+    """
+    Return a copy of ``context`` hashing with ``rounds`` rounds of its
+    default scheme, for which hashes made with fewer than ``tolerance``
+    less rounds are due for an update.
+
+    The tolerance keeps machines calibrated slightly differently from
+    upgrading each other's hashes back and forth; share a fixed
+    ``blogr.hashing.rounds`` between them to be sure.
+
+    """
+    scheme = context.default_scheme()
+    minimum = max(get_crypt_handler(scheme).min_rounds,
+                  int(rounds * (1 - tolerance)))
+    key = '%s__min_rounds' % scheme
+    settings = {'%s__default_rounds' % scheme: rounds, key: minimum}
+    for name in context.to_dict():
+        # per category minimums, e.g. admin__sha512_crypt__min_rounds
+        if name.endswith('__' + key):
+            settings[name] = minimum
+    return context.copy(**settings)
+
+
+def context_from_settings(settings, context=blogger_pwd_context):
+    """
+    Apply ``blogr.hashing.rounds`` to ``context``, or rounds calibrated
+    to ``blogr.hashing.target_ms`` if ``blogr.hashing.calibrate`` is on.
+
+    """
+    rounds = int(settings.get('blogr.hashing.rounds', 0))
+    if not rounds and asbool(settings.get('blogr.hashing.calibrate', False)):
+        target = int(settings.get('blogr.hashing.target_ms', 350)) / 1000.0
+        rounds = calibrate_rounds(context, target)
+        log.info('calibrated %s to %d rounds', context.default_scheme(),
+                 rounds)
+    if rounds:
+        context = calibrated_context(context, rounds)
+    return context
+
+
+#: hashes in the calling thread, for code running outside of requests
+inline_hasher = PasswordHasher(backend='inline')
+
+
+def includeme(config):
+    """
+    Set up ``request.password_hasher`` from the ``blogr.hashing.*``
+    settings.
+
+    Activate this setup using ``config.include('pyramid_blogr.passwords')``.
+
+    """
+    settings = config.get_settings()
+    hasher = PasswordHasher(
+        context_from_settings(settings),
+        backend=settings.get('blogr.hashing.backend', 'process'),
+        workers=int(settings.get('blogr.hashing.workers', 2)),
+        queue_size=int(settings.get('blogr.hashing.queue_size', 0)),
+        cleartext=asbool(settings.get('blogr.hashing.cleartext', False)))
+    config.registry['password_hasher'] = hasher
+    config.add_request_method(
+        lambda r: r.registry['password_hasher'], 'password_hasher',
+        reify=True)
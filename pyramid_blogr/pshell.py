@@ -11,3 +11,4 @@ def setup(env):
     env['tm'] = request.tm
     env['dbsession'] = request.dbsession
     env['models'] = models
+    env['response_cache'] = request.registry.get('response_cache')
@@ -0,0 +1,125 @@
+"""
+Counting and timing the SQL statements of each request.
+
+:func:`instrument` hooks the cursor executions of an engine.  Statements
+executed while a :class:`QueryStats` collector is current - in the
+context of a request passing through the tween - are counted and timed;
+others, like those of background threads or of response bodies streamed
+after the tween returned, are not.
+
+With ``blogr.query_stats`` on, every request logs its number of
+statements, the time spent in them and the slowest one to the
+``pyramid_blogr.querystats`` logger at ``INFO`` level, and
+``blogr.query_stats.server_timing`` adds the figures to the response as a
+``Server-Timing`` header for the browser's developer tools.
+
+"""
+import contextvars
+import logging
+import time
+
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS, MAIN
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+_collector = contextvars.ContextVar('blogr_query_stats', default=None)
+
+
+class QueryStats(object):
+    """ The statements executed during one request. """
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+        self.slowest = None
+        self.slowest_elapsed = 0.0
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.elapsed += elapsed
+        if self.slowest is None or elapsed > self.slowest_elapsed:
+            self.slowest = statement
+            self.slowest_elapsed = elapsed
+
+    def server_timing(self):
+        """ Return the value of a ``Server-Timing`` header. """
+        timing = 'db;dur=%.1f;desc="%d queries"' % (self.elapsed * 1000,
+                                                     self.count)
+        if self.slowest is not None:
+            timing += ', db-slowest;dur=%.1f' % (self.slowest_elapsed * 1000)
+        return timing
+
+
+def instrument(engine):
+    """ Count and time the statements ``engine`` executes. """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and _collector.get() is not None:
+            context._blogr_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        stats = _collector.get()
+        started = getattr(context, '_blogr_started', None)
+        if stats is not None and started is not None:
+            stats.record(statement, time.perf_counter() - started)
+
+
+def _one_line(statement, limit=200):
+    statement = ' '.join(statement.split())
+    if len(statement) > limit:
+        statement = statement[:limit - 3] + '...'
+    return statement
+
+
+def query_stats_tween_factory(handler, registry):
+    """
+    Collect the statements of each request, log them and add a
+    ``Server-Timing`` header if ``blogr.query_stats.server_timing`` is on.
+
+    """
+    server_timing = asbool(registry.settings.get(
+        'blogr.query_stats.server_timing', False))
+
+    def query_stats_tween(request):
+        stats = QueryStats()
+        token = _collector.set(stats)
+        try:
+            response = handler(request)
+        finally:
+            _collector.reset(token)
+            if stats.count:
+                log.info('%s %s: %d queries in %.1f ms, slowest %.1f ms: %s',
+                         request.method, request.path_qs, stats.count,
+                         stats.elapsed * 1000, stats.slowest_elapsed * 1000,
+                         _one_line(stats.slowest))
+            else:
+                log.info('%s %s: no queries', request.method,
+                         request.path_qs)
+        if server_timing:
+            response.headers.add('Server-Timing', stats.server_timing())
+        return response
+
+    return query_stats_tween
+
+
+def includeme(config):
+    """
+    Set up the per request statement statistics from the
+    ``blogr.query_stats.*`` settings.
+
+    Activate this setup using ``config.include('pyramid_blogr.querystats')``.
+
+    """
+    settings = config.get_settings()
+    if asbool(settings.get('blogr.query_stats', False)):
+        # above pyramid_tm, so that commits are counted too, and above the
+        # response cache, so that cached responses don't replay the
+        # figures of the request which filled the cache
+        config.add_tween(
+            'pyramid_blogr.querystats.query_stats_tween_factory',
+            under=INGRESS,
+            over=('pyramid_blogr.cache.response_cache_tween_factory', MAIN))
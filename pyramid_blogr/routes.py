@@ -1,8 +1,30 @@
+from pyramid.interfaces import IRoutesMapper
+
+
 def includeme(config):
     config.add_static_view('static', 'static', cache_max_age=3600)
     config.add_route('home', '/')
     config.add_route('blog', '/blog/{id:\d+}/{slug}')
+    config.add_route('feed', '/feed.atom')
+    config.add_route('search', '/search')
     config.add_route('blog_action', '/blog/{action}',
                      factory='pyramid_blogr.security.BlogRecordFactory')
+    config.add_route('export', '/export.{format:(ndjson|csv)}',
+                     factory='pyramid_blogr.security.BlogRecordFactory')
     config.add_route('auth', '/sign/{action}')
     config.add_route('register', '/register')
+
+
+def match_route(request):
+    """
+    Match ``request`` against the routes ahead of the router, for tweens
+    that need to know where a request is going.
+
+    Returns the ``{'route': ..., 'match': ...}`` dictionary of the routes
+    mapper; both values are ``None`` if no route matches.
+
+    """
+    mapper = request.registry.queryUtility(IRoutesMapper)
+    if mapper is None:
+        return {'route': None, 'match': None}
+    return mapper(request)
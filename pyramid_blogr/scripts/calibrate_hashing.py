@@ -0,0 +1,47 @@
+import argparse
+import sys
+import time
+
+from pyramid.paster import get_appsettings, setup_logging
+
+from ..passwords import (
+    blogger_pwd_context,
+    calibrate_rounds,
+    calibrated_context,
+    )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Find the password hash rounds matching a target '
+                    'verification time on this machine.')
+    parser.add_argument(
+        'config_uri',
+        help='Configuration file, e.g., development.ini',
+    )
+    parser.add_argument(
+        '--target-ms',
+        type=int,
+        help='Time one verification should take (default: '
+             'blogr.hashing.target_ms, or 350)',
+    )
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri)
+
+    target = args.target_ms or int(settings.get('blogr.hashing.target_ms',
+                                                350))
+    rounds = calibrate_rounds(blogger_pwd_context, target / 1000.0)
+    context = calibrated_context(blogger_pwd_context, rounds)
+    password_hash = context.hash(u'calibration')
+    started = time.perf_counter()
+    context.verify(u'calibration', password_hash)
+    elapsed = (time.perf_counter() - started) * 1000
+
+    print('%s: %d rounds, %.0f ms per verification'
+          % (context.default_scheme(), rounds, elapsed))
+    print('blogr.hashing.rounds = %d' % rounds)
@@ -0,0 +1,54 @@
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from .. import models
+from ..services.export import FORMATS, export_entries
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'config_uri',
+        help='Configuration file, e.g., development.ini',
+    )
+    parser.add_argument(
+        '--format',
+        choices=sorted(FORMATS),
+        default='ndjson',
+        help='Output format (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--output',
+        help='File to write to (default: standard output)',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Rows fetched per query (default: %(default)s)',
+    )
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    setup_logging(args.config_uri)
+    env = bootstrap(args.config_uri)
+
+    try:
+        engine = models.get_engine(env['registry'].settings)
+        if args.output:
+            output = open(args.output, 'wb')
+        else:
+            output = sys.stdout.buffer
+        try:
+            for chunk in export_entries(engine, args.format,
+                                        args.batch_size):
+                output.write(chunk)
+        finally:
+            if args.output:
+                output.close()
+    finally:
+        env['closer']()
@@ -0,0 +1,44 @@
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from .. import models
+from ..services.rehash import hash_cleartext_passwords
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'config_uri',
+        help='Configuration file, e.g., development.ini',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Hashing processes, 0 to hash in this process '
+             '(default: one per CPU)',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=500,
+        help='Users read and updated per transaction (default: %(default)s)',
+    )
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    setup_logging(args.config_uri)
+    env = bootstrap(args.config_uri)
+
+    try:
+        registry = env['registry']
+        engine = models.get_engine(registry.settings)
+        count = hash_cleartext_passwords(
+            engine, registry['password_hasher'].context,
+            batch_size=args.batch_size, workers=args.workers)
+        print('%d passwords hashed' % count)
+    finally:
+        env['closer']()
@@ -0,0 +1,73 @@
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from .. import models
+from ..services.importer import PARSERS, guess_format, import_entries
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'config_uri',
+        help='Configuration file, e.g., development.ini',
+    )
+    parser.add_argument(
+        'input',
+        help='File to import, or - for standard input',
+    )
+    parser.add_argument(
+        '--format',
+        choices=sorted(PARSERS),
+        help='Input format (default: guessed from the file extension)',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Rows inserted per transaction (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--checkpoint',
+        help='File recording progress, so an interrupted import can be '
+             'resumed; removed once the import finishes '
+             '(default: INPUT.checkpoint)',
+    )
+    parser.add_argument(
+        '--skip-duplicates',
+        action='store_true',
+        help='Skip entries whose title already exists',
+    )
+    args = parser.parse_args(argv[1:])
+    if args.format is None:
+        args.format = guess_format(args.input)
+        if args.format is None:
+            parser.error('cannot guess the format of %s, use --format'
+                         % args.input)
+    if args.checkpoint is None and args.input != '-':
+        args.checkpoint = args.input + '.checkpoint'
+    return args
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    setup_logging(args.config_uri)
+    env = bootstrap(args.config_uri)
+
+    try:
+        engine = models.get_engine(env['registry'].settings)
+        if args.input == '-':
+            stream = sys.stdin.buffer
+        else:
+            stream = open(args.input, 'rb')
+        try:
+            count = import_entries(
+                engine, PARSERS[args.format](stream),
+                batch_size=args.batch_size, checkpoint=args.checkpoint,
+                skip_duplicates=args.skip_duplicates)
+        finally:
+            stream.close()
+        print('%d records processed' % count)
+    finally:
+        env['closer']()
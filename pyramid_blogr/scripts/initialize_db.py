@@ -13,7 +13,8 @@ def setup_models(dbsession):
 
     """
 
-    model = models.user.User(name=u'admin', password=u'admin')
+    model = models.user.User(name=u'admin')
+    model.set_password(u'admin')
     dbsession.add(model)
 
 
@@ -0,0 +1,47 @@
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from .. import models
+from ..services.rerender import rerender_entries
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'config_uri',
+        help='Configuration file, e.g., development.ini',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Rendering processes, 0 to render in this process '
+             '(default: one per CPU)',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=500,
+        help='Entries rendered per transaction (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--all',
+        action='store_true',
+        help='Render every entry, not only stale ones',
+    )
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    setup_logging(args.config_uri)
+    env = bootstrap(args.config_uri)
+
+    try:
+        engine = models.get_engine(env['registry'].settings)
+        count = rerender_entries(engine, batch_size=args.batch_size,
+                                 workers=args.workers, force=args.all)
+        print('%d entries rendered' % count)
+    finally:
+        env['closer']()
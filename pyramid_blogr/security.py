@@ -1,10 +1,90 @@
+import time
+
+from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.security import Allow, Everyone, Authenticated
 
+from .services.user import UserService
+
+#: where the ticket of the current request is remembered once verified
+IDENTITY_KEY = 'pyramid_blogr.identity'
+
 
 class BlogRecordFactory(object):
     __acl__ = [(Allow, Everyone, 'view'),
                (Allow, Authenticated, 'create'),
-               (Allow, Authenticated, 'edit'), ]
+               (Allow, Authenticated, 'edit'),
+               (Allow, Authenticated, 'export'), ]
 
     def __init__(self, request):
         pass
+
+
+class CachingAuthTktAuthenticationPolicy(AuthTktAuthenticationPolicy):
+    """
+    An auth_tkt policy which verifies the ticket of a request only once
+    however often the request asks who is signed in, and keeps verified
+    tickets in ``ticket_cache`` (an :class:`~pyramid_blogr.cache.LRUCache`)
+    so later requests carrying the same cookie skip the HMAC check.
+
+    Tickets are only cached across requests when they aren't reissued,
+    since reissuing happens while a request is being verified.
+
+    """
+
+    def __init__(self, secret, ticket_cache=None, **kw):
+        super(CachingAuthTktAuthenticationPolicy, self).__init__(secret, **kw)
+        if self.cookie.reissue_time is not None:
+            ticket_cache = None
+        self.ticket_cache = ticket_cache
+
+    def _identify(self, request):
+        if self.ticket_cache is None:
+            return self.cookie.identify(request)
+        cookie = request.cookies.get(self.cookie.cookie_name)
+        if cookie is None:
+            return None
+        remote_addr = (request.environ['REMOTE_ADDR']
+                       if self.cookie.include_ip else None)
+        key = (cookie, remote_addr)
+
+        identity = self.ticket_cache.get(key)
+        if identity is None:
+            identity = self.cookie.identify(request)
+            if identity is not None:
+                self.ticket_cache.set(key, identity)
+            return identity
+
+        timeout = self.cookie.timeout
+        now = self.cookie.now or time.time()
+        if timeout and identity['timestamp'] + timeout < now:
+            return None
+        request.environ['REMOTE_USER_TOKENS'] = identity['tokens']
+        request.environ['REMOTE_USER_DATA'] = identity['userdata']
+        request.environ['AUTH_TYPE'] = 'cookie'
+        return identity
+
+    def unauthenticated_userid(self, request):
+        try:
+            identity = request.environ[IDENTITY_KEY]
+        except KeyError:
+            identity = request.environ[IDENTITY_KEY] = self._identify(request)
+        if identity:
+            return identity['userid']
+
+
+def get_user(request):
+    """ The signed in :class:`~pyramid_blogr.models.user.User`, if any. """
+    userid = request.authenticated_userid
+    if userid is None:
+        return None
+    return UserService.by_name(userid, request=request)
+
+
+def includeme(config):
+    """
+    Add ``request.user``, looked up once per request.
+
+    Activate this setup using ``config.include('pyramid_blogr.security')``.
+
+    """
+    config.add_request_method(get_user, 'user', reify=True)
@@ -0,0 +1,43 @@
+import atexit
+
+from pyramid.settings import asbool
+
+from ..models.events import EntriesChanged
+from .blog_record import EntryCounter
+from .group_commit import GroupCommitter
+from .user import LastLoginTracker
+
+
+def includeme(config):
+    """
+    Set up the shared state used by the services.
+
+    Activate this setup using ``config.include('pyramid_blogr.services')``.
+
+    """
+    settings = config.get_settings()
+
+    # remembered entry count handed to the offset paginator
+    counter = EntryCounter(
+        ttl=int(settings.get('blogr.entry_count.ttl', 60)),
+        approximate=asbool(settings.get('blogr.entry_count.approximate')))
+    config.registry['entry_counter'] = counter
+    config.add_subscriber(counter.entries_changed, EntriesChanged)
+
+    # sign in times, written behind the requests
+    tracker = LastLoginTracker(
+        config.registry['dbsession_factory'].kw['bind'],
+        interval=int(settings.get('blogr.last_login.interval', 30)),
+        threshold=int(settings.get('blogr.last_login.threshold', 100)))
+    atexit.register(tracker.flush)
+    config.registry['last_login'] = tracker
+
+    # entries posted at the same time, inserted in shared transactions
+    if asbool(settings.get('blogr.group_commit', False)):
+        committer = GroupCommitter(
+            config.registry['dbsession_factory'],
+            window=int(settings.get('blogr.group_commit.window_ms', 5))
+            / 1000.0,
+            max_batch=int(settings.get('blogr.group_commit.max_batch', 50)))
+        atexit.register(committer.close)
+        config.registry['group_commit'] = committer
@@ -0,0 +1,84 @@
+"""
+The skeleton shared by the bulk jobs: reading a table in primary key
+batches, spreading the work on each batch over a pool of worker processes
+and writing each batch back in a transaction of its own.
+
+"""
+import concurrent.futures
+import itertools
+import os
+
+from sqlalchemy.engine import Engine
+
+
+def iter_pk_batches(bind, query, pk, batch_size=1000):
+    """
+    Yield lists of at most ``batch_size`` rows of the select ``query`` in
+    ``pk`` order.
+
+    Each batch is its own query starting after the last ``pk`` seen, so
+    neither the database driver nor a session buffer the whole table.
+    ``bind`` is either a connection, held across batches, or an engine, of
+    which a connection is taken for each batch only.
+
+    """
+    last = 0
+    while True:
+        batch_query = query.where(pk > last).order_by(pk).limit(batch_size)
+        if isinstance(bind, Engine):
+            with bind.connect() as connection:
+                batch = connection.execute(batch_query).fetchall()
+        else:
+            batch = bind.execute(batch_query).fetchall()
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]._mapping[pk]
+
+
+def chunked(iterable, size):
+    """ Yield lists of at most ``size`` items of ``iterable``. """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def commit_batches(engine, batches, write, function=None, key=None,
+                   workers=None):
+    """
+    Call ``write(connection, batch, results)`` for each of ``batches`` in
+    a transaction of its own, and yield the batch once it is committed.
+
+    With a ``function``, ``results`` are the values of ``function`` for
+    the items of the batch - or for their ``key`` if one is given -
+    computed before the transaction begins, in ``workers`` processes (as
+    many as there are CPUs by default, or in this process if ``workers``
+    is 0).  Without one, ``results`` is None.
+
+    """
+    if function is None:
+        workers = 0
+    elif workers is None:
+        workers = os.cpu_count()
+    pool = (concurrent.futures.ProcessPoolExecutor(workers) if workers
+            else None)
+    try:
+        for batch in batches:
+            results = None
+            if function is not None:
+                values = [key(item) for item in batch] if key else batch
+                if pool is None:
+                    results = [function(value) for value in values]
+                else:
+                    results = list(pool.map(
+                        function, values,
+                        chunksize=max(1, len(values) // (workers * 4))))
+            with engine.begin() as connection:
+                write(connection, batch, results)
+            yield batch
+    finally:
+        if pool is not None:
+            pool.shutdown()
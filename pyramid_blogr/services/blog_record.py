@@ -1,6 +1,174 @@
+import collections
+import datetime
+import logging
+import operator
+import re
+import threading
+import time
+
 import sqlalchemy as sa
+from markupsafe import Markup, escape
+from sqlalchemy.orm import load_only, undefer_group
+from sqlalchemy.orm.attributes import set_committed_value
 from paginate_sqlalchemy import SqlalchemyOrmPage #<- provides pagination
+from webhelpers2.html import HTML, literal
+from ..markup import RENDERER_VERSION, render
 from ..models.blog_record import BlogRecord
+from ..models.readonly import READ_ONLY_KEY
+
+log = logging.getLogger(__name__)
+
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+# highlight markers, swapped for <mark> tags once the text is escaped
+HIGHLIGHT_OPEN = u'\x02'
+HIGHLIGHT_CLOSE = u'\x03'
+
+SearchResult = collections.namedtuple(
+    'SearchResult', 'id title slug title_html snippet_html rank')
+
+_search = sa.text("""
+    SELECT id, title, slug, title_html, snippet_html, rank FROM (
+        SELECT entries.id AS id, entries.title AS title,
+               entries.slug AS slug,
+               highlight(entries_fts, 0, :open, :close) AS title_html,
+               snippet(entries_fts, 1, :open, :close, '...', 24)
+                   AS snippet_html,
+               bm25(entries_fts, 10.0, 1.0) AS rank
+        FROM entries_fts JOIN entries ON entries.id = entries_fts.rowid
+        WHERE entries_fts MATCH :query
+    )
+    WHERE :after_rank IS NULL OR rank > :after_rank
+          OR (rank = :after_rank AND id > :after_id)
+    ORDER BY rank, id
+    LIMIT :limit
+""")
+
+
+def encode_cursor(entry):
+    """
+    Encode the ``(created, id)`` position of ``entry`` as an opaque,
+    URL-safe string.
+
+    """
+    return '%s.%d' % (entry.created.strftime(CURSOR_DATE_FORMAT), entry.id)
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by :func:`encode_cursor`.
+
+    Returns a ``(created, id)`` tuple or ``None`` if the cursor is missing
+    or malformed.
+
+    """
+    try:
+        created, _id = cursor.split('.')
+        return (datetime.datetime.strptime(created, CURSOR_DATE_FORMAT),
+                int(_id))
+    except (AttributeError, ValueError):
+        return None
+
+
+def match_query(terms):
+    """
+    Turn free text typed by a user into an FTS5 query matching entries
+    that contain all of its words.
+
+    """
+    return u' '.join(u'"%s"' % word for word in re.findall(r'\w+', terms))
+
+
+def _highlighted(text):
+    return Markup(escape(text or u'')
+                  .replace(HIGHLIGHT_OPEN, Markup(u'<mark>'))
+                  .replace(HIGHLIGHT_CLOSE, Markup(u'</mark>')))
+
+
+class KeysetPage(object):
+    """
+    A single page of entries fetched with keyset ("seek") pagination.
+
+    It mimics the parts of ``paginate.Page`` the templates rely on -
+    ``items`` and ``pager()`` - but links carry a cursor instead of a page
+    number, so every page costs the same to fetch.
+
+    """
+
+    def __init__(self, items, url_maker, next_cursor=None,
+                 previous_cursor=None):
+        self.items = items
+        self.url_maker = url_maker
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def pager(self, newer_label='&laquo; Newer', older_label='Older &raquo;'):
+        links = []
+        if self.previous_cursor:
+            links.append(HTML.tag(
+                'a', literal(newer_label), class_='pager_link',
+                href=self.url_maker(before=self.previous_cursor)))
+        if self.next_cursor:
+            links.append(HTML.tag(
+                'a', literal(older_label), class_='pager_link',
+                href=self.url_maker(after=self.next_cursor)))
+        return literal(' ').join(links)
+
+
+class EntryCounter(object):
+    """
+    Remembers how many blog entries there are so that paginators don't run
+    ``SELECT count(*)`` on every request.
+
+    The count is adjusted as committed inserts and deletes are reported
+    and read again from the database once it is older than ``ttl``
+    seconds.  With ``approximate`` the count is read as ``max(id)``, a
+    primary key lookup that overcounts rows which have been deleted.
+
+    """
+
+    def __init__(self, ttl=60, approximate=False, clock=time.monotonic):
+        self.ttl = ttl
+        self.approximate = approximate
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._count = None
+        self._expires = 0
+
+    def get(self, dbsession):
+        with self._lock:
+            if self._count is not None and self.clock() < self._expires:
+                return self._count
+        if self.approximate:
+            count = dbsession.query(sa.func.max(BlogRecord.id)).scalar()
+        else:
+            count = dbsession.query(sa.func.count(BlogRecord.id)).scalar()
+        with self._lock:
+            self._count = count or 0
+            self._expires = self.clock() + self.ttl
+            return self._count
+
+    def entries_changed(self, event):
+        with self._lock:
+            if self._count is not None:
+                self._count += len(event.inserted) - len(event.deleted)
+
+
+def _listing(query):
+    # listings only link to entries, so leave the body and the rest alone
+    return query.options(load_only(BlogRecord.id, BlogRecord.title,
+                                   BlogRecord.slug, BlogRecord.created))
+
+
+def _seek(position, op):
+    # (created, id) compared as a row value, spelled out for backends
+    # without row values; the redundant bound on created alone lets the
+    # database start the index scan at the cursor instead of skipping to it
+    created, _id = position
+    inclusive = operator.le if op is operator.lt else operator.ge
+    return sa.and_(inclusive(BlogRecord.created, created),
+                   sa.or_(op(BlogRecord.created, created),
+                          op(BlogRecord.id, _id)))
 
 
 class BlogRecordService(object):
@@ -8,17 +176,91 @@ class BlogRecordService(object):
     @classmethod
     def all(cls, request):
         query = request.dbsession.query(BlogRecord)
-        return query.order_by(sa.desc(BlogRecord.created))
+        return query.order_by(sa.desc(BlogRecord.created),
+                              sa.desc(BlogRecord.id))
+
+    @classmethod
+    def feed(cls, request, limit=None):
+        """
+        Newest entries with their bodies, for syndication.
+
+        """
+        query = cls.all(request).options(undefer_group('body'))
+        if limit:
+            query = query.limit(limit)
+        return query
 
     @classmethod
     def by_id(cls, _id, request):
         query = request.dbsession.query(BlogRecord)
-        return query.get(_id)
+        return query.options(undefer_group('body')).get(_id)
+
+    @classmethod
+    def render_stale(cls, request, entry):
+        """
+        Bring the stored HTML of ``entry`` up to date if it was rendered
+        by an older :data:`~pyramid_blogr.markup.RENDERER_VERSION`, or
+        not at all.
+
+        The new HTML is written without counting as an edit of the entry.
+        Requests whose session is read-only - on the fast path or on a
+        replica - write it to the primary in a short transaction of its
+        own; if that fails, the HTML is only used for this request.
+
+        """
+        if not entry.body_html_stale:
+            return entry
+        html = render(entry.body)
+        if not request.dbsession.info.get(READ_ONLY_KEY):
+            cls._store_html(request.dbsession, entry.id, html)
+        else:
+            session = request.registry['dbsession_factory']()
+            try:
+                cls._store_html(session, entry.id, html)
+                session.commit()
+            except sa.exc.SQLAlchemyError:
+                log.warning('could not store the HTML of entry %d',
+                            entry.id, exc_info=True)
+                session.rollback()
+            finally:
+                session.close()
+        set_committed_value(entry, 'body_html', html)
+        set_committed_value(entry, 'body_html_version', RENDERER_VERSION)
+        return entry
+
+    @classmethod
+    def _store_html(cls, session, _id, html):
+        session.query(BlogRecord).filter(BlogRecord.id == _id).update(
+            {BlogRecord.body_html: html,
+             BlogRecord.body_html_version: RENDERER_VERSION,
+             # keep the onupdate default from touching it
+             BlogRecord.edited: BlogRecord.edited},
+            synchronize_session=False)
+
+    @classmethod
+    def last_edited(cls, request, _id=None):
+        """
+        Return when the entry ``_id`` was last edited, or when any entry
+        was if no id is given.
+
+        """
+        query = request.dbsession.query(sa.func.max(BlogRecord.edited))
+        if _id is not None:
+            query = query.filter(BlogRecord.id == _id)
+        return query.scalar()
+
+    @classmethod
+    def count(cls, request):
+        counter = request.registry.get('entry_counter')
+        if counter is not None:
+            return counter.get(request.dbsession)
+        return request.dbsession.query(sa.func.count(BlogRecord.id)).scalar()
 
     @classmethod
     def get_paginator(cls, request, page=1):
-        query = request.dbsession.query(BlogRecord)
-        query = query.order_by(sa.desc(BlogRecord.created))
+        query = _listing(request.dbsession.query(BlogRecord))
+        query = query.order_by(sa.desc(BlogRecord.created),
+                               sa.desc(BlogRecord.id))
         query_params = request.GET.mixed()
 
         def url_maker(link_page):
@@ -27,4 +269,97 @@ class BlogRecordService(object):
             return request.current_route_url(_query=query_params)
 
         return SqlalchemyOrmPage(query, page, items_per_page=5,
+                                 item_count=cls.count(request),
                                  url_maker=url_maker)
+
+    @classmethod
+    def get_keyset_paginator(cls, request, after=None, before=None,
+                             items_per_page=5):
+        """
+        Return a :class:`KeysetPage` of entries ordered newest first.
+
+        ``after`` and ``before`` are cursors taken from the links of a
+        previous page; entries older than ``after`` or newer than
+        ``before`` are returned.  Without a cursor the first page is
+        returned.
+
+        """
+        after = decode_cursor(after)
+        before = decode_cursor(before) if after is None else None
+
+        query = _listing(request.dbsession.query(BlogRecord))
+        if before is not None:
+            # walk towards newer entries and flip them back afterwards
+            query = query.filter(_seek(before, operator.gt))
+            query = query.order_by(BlogRecord.created, BlogRecord.id)
+        else:
+            if after is not None:
+                query = query.filter(_seek(after, operator.lt))
+            query = query.order_by(sa.desc(BlogRecord.created),
+                                   sa.desc(BlogRecord.id))
+        # fetch one extra row to know whether there is anything beyond
+        items = query.limit(items_per_page + 1).all()
+        has_more = len(items) > items_per_page
+        items = items[:items_per_page]
+
+        if before is not None:
+            items.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = after is not None, has_more
+
+        query_params = request.GET.mixed()
+        for param in ('page', 'after', 'before'):
+            query_params.pop(param, None)
+
+        def url_maker(**cursor):
+            # replace cursor params with the ones generated by the page
+            params = dict(query_params, **cursor)
+            return request.current_route_url(_query=params)
+
+        return KeysetPage(
+            items, url_maker,
+            next_cursor=encode_cursor(items[-1])
+            if items and has_older else None,
+            previous_cursor=encode_cursor(items[0])
+            if items and has_newer else None)
+
+    @classmethod
+    def search(cls, request, terms, after=None, items_per_page=10):
+        """
+        Return a :class:`KeysetPage` of :class:`SearchResult` for entries
+        matching all words of ``terms``, best bm25 rank first.
+
+        Titles and snippets of the body come with matches highlighted by
+        ``<mark>`` tags.  ``after`` is the cursor of the next page link.
+
+        """
+        query = match_query(terms or u'')
+        if not query:
+            return KeysetPage([], None)
+        try:
+            rank, _id = after.rsplit('_', 1)
+            after = (float(rank), int(_id))
+        except (AttributeError, ValueError):
+            after = (None, None)
+
+        rows = request.dbsession.execute(_search, {
+            'open': HIGHLIGHT_OPEN, 'close': HIGHLIGHT_CLOSE,
+            'query': query, 'after_rank': after[0], 'after_id': after[1],
+            'limit': items_per_page + 1}).fetchall()
+        items = [SearchResult(row.id, row.title, row.slug,
+                              _highlighted(row.title_html),
+                              _highlighted(row.snippet_html), row.rank)
+                 for row in rows[:items_per_page]]
+
+        query_params = request.GET.mixed()
+        query_params.pop('after', None)
+
+        def url_maker(**cursor):
+            return request.current_route_url(_query=dict(query_params,
+                                                         **cursor))
+
+        next_cursor = None
+        if len(rows) > items_per_page:
+            next_cursor = '%r_%d' % (items[-1].rank, items[-1].id)
+        return KeysetPage(items, url_maker, next_cursor=next_cursor)
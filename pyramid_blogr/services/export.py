@@ -0,0 +1,77 @@
+"""
+Streaming dumps of the ``entries`` table.
+
+Rows are read straight from the table in primary key batches, without the
+ORM, and encoded one batch at a time, so exporting any number of entries
+takes the same amount of memory.
+
+"""
+import csv
+import io
+import json
+
+import sqlalchemy as sa
+
+from ..models.blog_record import BlogRecord
+from .batch import iter_pk_batches
+
+EXPORT_COLUMNS = ('id', 'title', 'slug', 'body', 'created', 'edited')
+
+
+def iter_entry_batches(connection, batch_size=1000):
+    """
+    Yield lists of at most ``batch_size`` entry rows in primary key order,
+    all read through ``connection``.
+
+    """
+    table = BlogRecord.__table__
+    return iter_pk_batches(
+        connection, sa.select(*[table.c[name] for name in EXPORT_COLUMNS]),
+        table.c.id, batch_size)
+
+
+def _values(row):
+    return [value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in row]
+
+
+def encode_ndjson(batches):
+    """ Encode batches of rows as newline delimited JSON. """
+    for batch in batches:
+        yield u''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, _values(row)))) + u'\n'
+            for row in batch).encode('utf-8')
+
+
+def encode_csv(batches):
+    """ Encode batches of rows as CSV with a header line. """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows(_values(row) for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+#: encoder and content type for each export format
+FORMATS = {
+    'ndjson': (encode_ndjson, 'application/x-ndjson'),
+    'csv': (encode_csv, 'text/csv'),
+}
+
+
+def export_entries(engine, format, batch_size=1000):
+    """
+    Yield the encoded dump of all entries as chunks of bytes.
+
+    A connection is held only while the generator is being consumed.
+
+    """
+    encode = FORMATS[format][0]
+    with engine.connect() as connection:
+        for chunk in encode(iter_entry_batches(connection, batch_size)):
+            yield chunk
@@ -0,0 +1,131 @@
+"""
+Group commit for inserts coming from many requests at once.
+
+Every transaction committed on its own pays for its own sync to disk.
+:class:`GroupCommitter` collects the objects concurrent requests hand it
+and inserts those arriving within a few milliseconds of each other in one
+transaction.  The requests wait for the outcome of their own insert: if a
+shared transaction fails, its objects are inserted again one transaction
+each, so one bad row doesn't fail the others.
+
+"""
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import inspect
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def _copy(obj):
+    # every attempt inserts a fresh copy; the submitted object stays with
+    # the request that built it
+    state = inspect(obj)
+    return type(obj)(**{
+        attr.key: state.dict[attr.key] for attr in state.mapper.column_attrs
+        if attr.key in state.dict})
+
+
+class GroupCommitter(object):
+    """
+    Inserts objects in transactions shared by everything submitted within
+    ``window`` seconds of the first of them, at most ``max_batch`` objects
+    a transaction.
+
+    """
+
+    def __init__(self, session_factory, window=0.005, max_batch=50):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, obj):
+        """
+        Insert a copy of the transient ``obj``.
+
+        Returns a :class:`concurrent.futures.Future` of the inserted copy,
+        detached from its session, or of the exception inserting it
+        raised.
+
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+            self._queue.put((obj, future))
+        return future
+
+    def insert(self, obj):
+        """ Insert a copy of ``obj`` and wait for it; see :meth:`submit`. """
+        return self.submit(obj).result()
+
+    def close(self):
+        """ Insert what has been submitted and stop the committer thread. """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+        thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(
+                        timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._commit(batch)
+                    return
+                batch.append(item)
+            self._commit(batch)
+
+    def _insert(self, objs):
+        session = self.session_factory(expire_on_commit=False)
+        try:
+            copies = [_copy(obj) for obj in objs]
+            session.add_all(copies)
+            session.commit()
+            return copies
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _commit(self, batch):
+        try:
+            copies = self._insert([obj for obj, future in batch])
+        except Exception as exc:
+            if len(batch) == 1:
+                batch[0][1].set_exception(exc)
+                return
+            log.info('group commit of %d objects failed, inserting them '
+                     'one by one', len(batch))
+            for obj, future in batch:
+                try:
+                    copy, = self._insert([obj])
+                except Exception as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(copy)
+        else:
+            for (obj, future), copy in zip(batch, copies):
+                future.set_result(copy)
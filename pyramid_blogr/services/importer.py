@@ -0,0 +1,195 @@
+"""
+Bulk loading of entries from NDJSON, CSV and WordPress (WXR) exports.
+
+Records are parsed incrementally and inserted with Core ``executemany``
+statements, one transaction per batch.  The number of records committed
+so far is kept in a checkpoint file so an interrupted import can pick up
+where it stopped.
+
+Rows inserted this way bypass the ORM session, so they are added to the
+full-text index here, and running applications only see them once their
+caches expire.
+
+"""
+import csv
+import datetime
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+from xml.etree import ElementTree
+
+from ..models.blog_record import BlogRecord, make_slug
+from ..models.search import index_new_entries
+from .batch import chunked, commit_batches
+
+log = logging.getLogger(__name__)
+
+WXR_CONTENT = '{http://purl.org/rss/1.0/modules/content/}encoded'
+WXR_NAMESPACE = '{http://wordpress.org/export/'
+
+
+def parse_ndjson(stream):
+    for line in io.TextIOWrapper(stream, encoding='utf-8'):
+        if line.strip():
+            yield json.loads(line)
+
+
+def parse_csv(stream):
+    # csv refuses fields over 128 KiB by default, shorter than some bodies;
+    # the limit is a C long
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+    for record in csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8',
+                                                  newline='')):
+        yield record
+
+
+def parse_wxr(stream):
+    """
+    Yield the posts of a WordPress eXtended RSS export.
+
+    Items are cleared as soon as they have been read, so the document is
+    never held in memory as a whole.
+
+    """
+    channel = None
+    for event, element in ElementTree.iterparse(stream,
+                                                events=('start', 'end')):
+        if event == 'start':
+            if element.tag == 'channel':
+                channel = element
+            continue
+        if element.tag != 'item':
+            continue
+        fields = {}
+        for child in element:
+            if child.tag.startswith(WXR_NAMESPACE):
+                fields[child.tag.rsplit('}', 1)[1]] = child.text
+        if fields.get('post_type', 'post') == 'post':
+            yield {
+                'title': element.findtext('title'),
+                'body': element.findtext(WXR_CONTENT),
+                'created': fields.get('post_date_gmt'),
+                'edited': fields.get('post_modified_gmt'),
+            }
+        if channel is not None:
+            channel.remove(element)
+
+
+PARSERS = {
+    'ndjson': parse_ndjson,
+    'csv': parse_csv,
+    'wxr': parse_wxr,
+}
+
+EXTENSIONS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.xml': 'wxr',
+    '.wxr': 'wxr',
+}
+
+
+def guess_format(path):
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def _date(value, default):
+    if not isinstance(value, datetime.datetime):
+        try:
+            value = datetime.datetime.fromisoformat(
+                value.strip().replace('Z', '+00:00'))
+        except (AttributeError, ValueError):
+            # missing, or WordPress' 0000-00-00 00:00:00 for drafts
+            return default
+    if value.tzinfo is not None:
+        # entries store naive UTC
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def prepare(record, now=None):
+    """
+    Turn a parsed record into a row of the ``entries`` table.
+
+    """
+    now = now or datetime.datetime.utcnow()
+    title = (record.get('title') or u'').strip()
+    created = _date(record.get('created'), now)
+    return {
+        'title': title,
+        'slug': make_slug(title),
+        'body': record.get('body') or u'',
+        'created': created,
+        'edited': _date(record.get('edited'), created),
+    }
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except (IOError, OSError):
+        return 0
+
+
+def write_checkpoint(path, count):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('%d\n' % count)
+    os.replace(tmp, path)
+
+
+def remove_checkpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def import_entries(engine, records, batch_size=1000, checkpoint=None,
+                   skip_duplicates=False):
+    """
+    Insert ``records`` into ``entries`` in batches of ``batch_size``.
+
+    If a ``checkpoint`` path is given, records counted there are skipped
+    and the count is advanced after every committed batch; the file is
+    removed once all records are in, so that it only ever resumes an
+    import which didn't finish.  With
+    ``skip_duplicates`` records whose title already exists are dropped
+    instead of failing their batch.
+
+    Returns the number of records processed.
+
+    """
+    done = read_checkpoint(checkpoint) if checkpoint else 0
+    if done:
+        log.info('resuming after %d records', done)
+    records = itertools.islice(records, done, None)
+
+    table = BlogRecord.__table__
+    insert = table.insert().returning(table.c.id)
+    if skip_duplicates:
+        insert = insert.prefix_with('OR IGNORE', dialect='sqlite')
+
+    def write(connection, batch, results):
+        now = datetime.datetime.utcnow()
+        rows = [prepare(record, now) for record in batch]
+        rows = [row for row in rows if row['title']]
+        if rows:
+            # only what this batch inserted: entries posted meanwhile are
+            # indexed already
+            ids = connection.execute(insert, rows).scalars().all()
+            index_new_entries(connection, ids)
+
+    for batch in commit_batches(engine, chunked(records, batch_size), write):
+        done += len(batch)
+        if checkpoint:
+            write_checkpoint(checkpoint, done)
+        log.info('imported %d records', done)
+    if checkpoint:
+        remove_checkpoint(checkpoint)
+    return done
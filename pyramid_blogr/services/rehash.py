@@ -0,0 +1,70 @@
+"""
+Bulk hashing of passwords still stored in cleartext.
+
+Users are read in primary key batches, the passwords the hashing context
+doesn't recognise are hashed across a pool of worker processes and each
+batch is written back in a transaction of its own.  A row is only updated
+if its password hasn't changed since it was read.
+
+"""
+import functools
+import logging
+import operator
+
+import sqlalchemy as sa
+
+from ..models.user import User
+from ..passwords import blogger_pwd_context, call_context
+from .batch import commit_batches, iter_pk_batches
+
+log = logging.getLogger(__name__)
+
+
+def iter_cleartext_batches(engine, context=blogger_pwd_context,
+                           batch_size=500):
+    """
+    Yield lists of ``(id, password)`` rows whose password is not a hash
+    ``context`` can identify, reading ``batch_size`` users at a time.
+
+    """
+    table = User.__table__
+    for rows in iter_pk_batches(
+            engine, sa.select(table.c.id, table.c.password), table.c.id,
+            batch_size):
+        batch = [row for row in rows
+                 if context.identify(row.password, required=False) is None]
+        if batch:
+            yield batch
+
+
+def hash_cleartext_passwords(engine, context=blogger_pwd_context,
+                             batch_size=500, workers=None):
+    """
+    Hash the cleartext passwords with ``context``, in ``workers``
+    processes (as many as there are CPUs by default, or in this process
+    if ``workers`` is 0).
+
+    Returns the number of passwords hashed.
+
+    """
+    table = User.__table__
+    update = (table.update()
+              .where(table.c.id == sa.bindparam('_id'))
+              .where(table.c.password == sa.bindparam('_old'))
+              .values(password=sa.bindparam('_new')))
+    hash_password = functools.partial(call_context, context.to_string(),
+                                      'hash')
+
+    def write(connection, batch, hashes):
+        connection.execute(update, [
+            {'_id': row.id, '_old': row.password, '_new': new}
+            for row, new in zip(batch, hashes)])
+
+    done = 0
+    for batch in commit_batches(
+            engine, iter_cleartext_batches(engine, context, batch_size),
+            write, hash_password, key=operator.attrgetter('password'),
+            workers=workers):
+        done += len(batch)
+        log.info('hashed %d passwords', done)
+    return done
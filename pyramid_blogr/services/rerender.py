@@ -0,0 +1,64 @@
+"""
+Bulk re-rendering of entry bodies whose stored HTML is missing or was
+made by an older :data:`~pyramid_blogr.markup.RENDERER_VERSION`.
+
+Stale rows are read in primary key batches whose bodies are spread over
+a pool of worker processes; the parent writes each rendered batch back
+in a transaction of its own.  ``edited`` is left alone, re-rendering
+is not an edit.
+
+"""
+import logging
+import operator
+
+import sqlalchemy as sa
+
+from ..markup import RENDERER_VERSION, render
+from ..models.blog_record import BlogRecord
+from .batch import commit_batches, iter_pk_batches
+
+log = logging.getLogger(__name__)
+
+
+def iter_stale_batches(engine, batch_size=500, force=False):
+    """
+    Yield lists of at most ``batch_size`` ``(id, body)`` rows needing a
+    render, all rows with ``force``.
+
+    """
+    table = BlogRecord.__table__
+    query = sa.select(table.c.id, table.c.body)
+    if not force:
+        query = query.where(sa.or_(
+            table.c.body_html_version.is_(None),
+            table.c.body_html_version != RENDERER_VERSION))
+    return iter_pk_batches(engine, query, table.c.id, batch_size)
+
+
+def rerender_entries(engine, batch_size=500, workers=None, force=False):
+    """
+    Render the stale entries, in ``workers`` processes (as many as there
+    are CPUs by default, or in this process if ``workers`` is 0).
+
+    Returns the number of entries rendered.
+
+    """
+    table = BlogRecord.__table__
+    update = (table.update()
+              .where(table.c.id == sa.bindparam('_id'))
+              .values(body_html=sa.bindparam('_html'),
+                      body_html_version=RENDERER_VERSION,
+                      edited=table.c.edited))
+
+    def write(connection, batch, rendered):
+        connection.execute(update, [
+            {'_id': row.id, '_html': html}
+            for row, html in zip(batch, rendered)])
+
+    done = 0
+    for batch in commit_batches(
+            engine, iter_stale_batches(engine, batch_size, force), write,
+            render, key=operator.attrgetter('body'), workers=workers):
+        done += len(batch)
+        log.info('rendered %d entries', done)
+    return done
@@ -1,8 +1,103 @@
+import datetime
+import logging
+import threading
+
+import sqlalchemy as sa
+
 from ..models.user import User
 
+log = logging.getLogger(__name__)
+
 
 class UserService(object):
 
     @classmethod
     def by_name(cls, name, request):
         return request.dbsession.query(User).filter(User.name == name).first()
+
+
+class LastLoginTracker(object):
+    """
+    Collects sign in times in memory and writes them to
+    ``users.last_logged`` later, so signing in doesn't cost a write
+    transaction.
+
+    Pending times are written in one batched ``UPDATE`` at most
+    ``interval`` seconds after the first of them was recorded, as soon as
+    ``threshold`` users are pending, and when the process exits.  Only the
+    latest time of each user is kept.  A batch which couldn't be written
+    is kept and tried again after ``interval`` seconds, twice as long
+    after every further failure up to ``MAX_BACKOFF`` intervals.
+
+    """
+
+    #: most intervals waited between attempts to write a failed batch
+    MAX_BACKOFF = 16
+
+    def __init__(self, engine, interval=30, threshold=100,
+                 clock=datetime.datetime.utcnow):
+        self.engine = engine
+        self.interval = interval
+        self.threshold = threshold
+        self.clock = clock
+        self._pending = {}
+        self._timer = None
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _keep(self, user_id, when):
+        previous = self._pending.get(user_id)
+        if previous is None or when > previous:
+            self._pending[user_id] = when
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def record(self, user_id, when=None):
+        when = when or self.clock()
+        with self._lock:
+            self._keep(user_id, when)
+            if len(self._pending) >= self.threshold and not self._failures:
+                self._schedule(0)
+            elif self._timer is None:
+                self._schedule(self.interval)
+
+    def flush(self):
+        """ Write the pending sign in times now. """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return
+        table = User.__table__
+        update = (table.update()
+                  .where(table.c.id == sa.bindparam('_id'))
+                  # other processes may have written a later time
+                  .where(sa.or_(table.c.last_logged.is_(None),
+                                table.c.last_logged < sa.bindparam('_when')))
+                  .values(last_logged=sa.bindparam('_when')))
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(update, [
+                    {'_id': user_id, '_when': when}
+                    for user_id, when in pending.items()])
+        except Exception:
+            log.exception('could not write %d sign in times', len(pending))
+            with self._lock:
+                for user_id, when in pending.items():
+                    self._keep(user_id, when)
+                self._failures += 1
+                self._schedule(self.interval * min(
+                    2 ** (self._failures - 1), self.MAX_BACKOFF))
+        else:
+            with self._lock:
+                self._failures = 0
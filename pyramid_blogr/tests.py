@@ -1,3 +1,4 @@
+import contextlib
 import unittest
 
 from pyramid import testing
@@ -9,6 +10,50 @@ def dummy_request(dbsession):
     return testing.DummyRequest(dbsession=dbsession)
 
 
+@contextlib.contextmanager
+def capture_statements(engine):
+    """ Collect the SQL statements sent through ``engine``. """
+    from sqlalchemy import event
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+
+def explain_query_plan(engine, run_query):
+    """
+    Run ``run_query`` and return the SQLite query plan of every SELECT it
+    issued, as a list of ``(statement, plan details)`` pairs.
+
+    """
+    from sqlalchemy import event
+
+    plans = []
+
+    def explain(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            explain_cursor = conn.connection.cursor()
+            explain_cursor.execute('EXPLAIN QUERY PLAN ' + statement,
+                                   parameters)
+            plans.append(
+                (statement, [row[-1] for row in explain_cursor.fetchall()]))
+            explain_cursor.close()
+
+    event.listen(engine, 'before_cursor_execute', explain)
+    try:
+        run_query()
+    finally:
+        event.remove(engine, 'before_cursor_execute', explain)
+    return plans
+
+
 class BaseTest(unittest.TestCase):
     def setUp(self):
         self.config = testing.setUp(settings={
@@ -32,6 +77,34 @@ class BaseTest(unittest.TestCase):
         from .models.meta import Base
         Base.metadata.create_all(self.engine)
 
+    def add_entries(self, count, title=u'entry {}', body=u'body {}'):
+        """
+        Add and commit ``count`` entries, ``title`` and ``body`` formatted
+        with their number.
+
+        """
+        from .models.blog_record import BlogRecord
+
+        self.session.add_all(
+            BlogRecord(title=title.format(i), body=body.format(i))
+            for i in range(count))
+        transaction.commit()
+
+    def route_request(self, route_name='home', **params):
+        """
+        A dummy request on ``self.session`` matched to ``route_name``,
+        with ``params`` as its query string.
+
+        """
+        from webob.multidict import MultiDict
+
+        request = dummy_request(self.session)
+        request.GET = request.params = MultiDict(params)
+        request.matched_route = self.config.get_routes_mapper().get_route(
+            route_name)
+        request.matchdict = {}
+        return request
+
     def tearDown(self):
         from .models.meta import Base
 
@@ -64,3 +137,1891 @@ class TestMyViewFailureCondition(BaseTest):
         from .views.default import my_view
         info = my_view(dummy_request(self.session))
         self.assertEqual(info.status_int, 500)
+
+
+class TestKeysetPaginator(BaseTest):
+
+    def setUp(self):
+        super(TestKeysetPaginator, self).setUp()
+        self.init_database()
+        self.config.add_route('home', '/')
+
+        import datetime
+        from .models.blog_record import BlogRecord
+
+        start = datetime.datetime(2018, 12, 23)
+        for i in range(12):
+            self.session.add(BlogRecord(
+                title=u'entry %d' % i, body=u'body',
+                created=start + datetime.timedelta(minutes=i)))
+        # two entries sharing a timestamp are told apart by id
+        self.session.add(BlogRecord(title=u'entry 12', body=u'body',
+                                    created=start))
+        self.session.flush()
+
+    def _titles(self, page):
+        return [entry.title for entry in page.items]
+
+    def test_walks_forward_and_back(self):
+        from .services.blog_record import BlogRecordService
+
+        seen = []
+        page = BlogRecordService.get_keyset_paginator(self.route_request())
+        self.assertIsNone(page.previous_cursor)
+        pages = [page]
+        while page.next_cursor:
+            seen.extend(self._titles(page))
+            page = BlogRecordService.get_keyset_paginator(
+                self.route_request(), after=page.next_cursor)
+            pages.append(page)
+        seen.extend(self._titles(page))
+        self.assertEqual(
+            seen, [u'entry %d' % i for i in range(11, 0, -1)] +
+            [u'entry 12', u'entry 0'])
+        self.assertEqual([len(p.items) for p in pages], [5, 5, 3])
+
+        back = BlogRecordService.get_keyset_paginator(
+            self.route_request(), before=pages[2].previous_cursor)
+        self.assertEqual(self._titles(back), self._titles(pages[1]))
+        back = BlogRecordService.get_keyset_paginator(
+            self.route_request(), before=back.previous_cursor)
+        self.assertEqual(self._titles(back), self._titles(pages[0]))
+        self.assertIsNone(back.previous_cursor)
+
+    def test_pager_links_carry_cursor(self):
+        from .services.blog_record import BlogRecordService
+
+        page = BlogRecordService.get_keyset_paginator(
+            self.route_request(page='3', q='x'))
+        pager = page.pager()
+        self.assertIn('after=%s' % page.next_cursor, pager)
+        self.assertIn('q=x', pager)
+        self.assertNotIn('page=', pager)
+        self.assertNotIn('Newer', pager)
+
+    def test_bad_cursor_returns_first_page(self):
+        from .services.blog_record import BlogRecordService
+
+        page = BlogRecordService.get_keyset_paginator(
+            self.route_request(), after='garbage')
+        self.assertEqual(self._titles(page)[0], u'entry 11')
+
+    def test_index_page_uses_keyset_mode(self):
+        from .services.blog_record import KeysetPage
+        from .views.default import index_page
+
+        self.config.registry.settings['blogr.pagination'] = 'keyset'
+        info = index_page(self.route_request())
+        self.assertIsInstance(info['paginator'], KeysetPage)
+
+
+class TestEntryCounter(BaseTest):
+
+    def setUp(self):
+        super(TestEntryCounter, self).setUp()
+        self.init_database()
+
+        from .models import get_session_factory
+        from .models.events import track_entry_changes
+
+        self.session_factory = get_session_factory(self.engine)
+        track_entry_changes(self.session_factory, self.config.registry)
+        self.config.include('.services')
+        self.counter = self.config.registry['entry_counter']
+
+    def _add(self, title):
+        from .models import get_tm_session
+        from .models.blog_record import BlogRecord
+
+        with transaction.manager:
+            session = get_tm_session(self.session_factory,
+                                     transaction.manager)
+            session.add(BlogRecord(title=title, body=u'body'))
+
+    def _add_unnoticed(self, title):
+        from .models.blog_record import BlogRecord
+
+        with self.engine.begin() as connection:
+            connection.execute(
+                BlogRecord.__table__.insert().values(title=title))
+
+    def test_count_follows_committed_inserts(self):
+        self._add(u'one')
+        self.assertEqual(self.counter.get(self.session), 1)
+        # rows written behind the counter's back are not seen...
+        self._add_unnoticed(u'sneaky')
+        self._add(u'two')
+        # ...but committed inserts are counted without asking again
+        self.assertEqual(self.counter.get(self.session), 2)
+
+    def test_count_is_read_again_after_ttl(self):
+        now = [0]
+        self.counter.clock = lambda: now[0]
+        self._add(u'one')
+        self.assertEqual(self.counter.get(self.session), 1)
+        self._add_unnoticed(u'sneaky')
+        self.assertEqual(self.counter.get(self.session), 1)
+        now[0] = self.counter.ttl + 1
+        self.assertEqual(self.counter.get(self.session), 2)
+
+    def test_approximate_count(self):
+        self.counter.approximate = True
+        self._add(u'one')
+        self._add(u'two')
+        self.assertEqual(self.counter.get(self.session), 2)
+
+    def test_paginator_uses_counter(self):
+        from .services.blog_record import BlogRecordService
+
+        self._add(u'one')
+        self.counter.get(self.session)
+        self.counter._count = 42
+        page = BlogRecordService.get_paginator(self.route_request())
+        self.assertEqual(page.item_count, 42)
+        self.assertEqual(page.page_count, 9)
+
+
+class TestListingQueryPlans(BaseTest):
+
+    def setUp(self):
+        super(TestListingQueryPlans, self).setUp()
+        self.init_database()
+        self.config.add_route('home', '/')
+
+    def assertUsesCreatedIndex(self, run_query):
+        # the listings, not the count the offset paginator runs as well
+        plans = [plan for statement, plan
+                 in explain_query_plan(self.engine, run_query)
+                 if 'ORDER BY' in statement]
+        self.assertTrue(plans)
+        for plan in plans:
+            # a single step walking the index in order, no sort after it
+            self.assertEqual(len(plan), 1, plan)
+            self.assertRegex(
+                plan[0],
+                r'^(SCAN|SEARCH) entries USING INDEX ix_entries_created_id\b')
+        return plans
+
+    def test_all(self):
+        from .services.blog_record import BlogRecordService
+        self.assertUsesCreatedIndex(
+            lambda: BlogRecordService.all(self.route_request()).all())
+
+    def test_offset_paginator(self):
+        from .services.blog_record import BlogRecordService
+        self.assertUsesCreatedIndex(
+            lambda: BlogRecordService.get_paginator(self.route_request(), 3))
+
+    def test_keyset_paginator(self):
+        from .services.blog_record import BlogRecordService
+        self.assertUsesCreatedIndex(lambda: (
+            BlogRecordService.get_keyset_paginator(self.route_request())))
+        for cursor in ({'after': '20181223000000000000.7'},
+                       {'before': '20181223000000000000.7'}):
+            plans = self.assertUsesCreatedIndex(
+                lambda: BlogRecordService.get_keyset_paginator(
+                    self.route_request(), **cursor))
+            # the scan starts at the cursor rather than walking up to it
+            self.assertRegex(
+                plans[0][0], r'^SEARCH entries USING INDEX '
+                r'ix_entries_created_id \(created[<>]\?\)$')
+
+
+class TestDeferredBody(BaseTest):
+
+    def setUp(self):
+        super(TestDeferredBody, self).setUp()
+        self.init_database()
+        self.config.add_route('home', '/')
+
+        from .models.blog_record import BlogRecord
+
+        self.session.add(BlogRecord(title=u'one', body=u'x' * 1000))
+        self.session.flush()
+        self.session.expunge_all()
+
+    def _unloaded(self, entry):
+        from sqlalchemy import inspect
+        return inspect(entry).unloaded
+
+    def test_listings_leave_body_unloaded(self):
+        from .services.blog_record import BlogRecordService
+
+        for page in (BlogRecordService.get_paginator(self.route_request()),
+                     BlogRecordService.get_keyset_paginator(
+                         self.route_request())):
+            entry = page.items[0]
+            self.assertEqual(entry.title, u'one')
+            self.assertIn('body', self._unloaded(entry))
+            self.assertIn('edited', self._unloaded(entry))
+            self.session.expunge_all()
+
+    def test_by_id_loads_body(self):
+        from .services.blog_record import BlogRecordService
+
+        entry = BlogRecordService.by_id(1, self.route_request())
+        self.assertNotIn('body', self._unloaded(entry))
+        self.assertEqual(len(entry.body), 1000)
+
+
+class TestStoredSlug(BaseTest):
+
+    def setUp(self):
+        super(TestStoredSlug, self).setUp()
+        self.init_database()
+
+    def test_slug_follows_title(self):
+        from .forms import BlogUpdateForm
+        from .models.blog_record import BlogRecord
+        from webob.multidict import MultiDict
+
+        entry = BlogRecord(title=u'Hello World', body=u'body')
+        self.assertEqual(entry.slug, u'hello-world')
+        form = BlogUpdateForm(MultiDict(title=u'Second Take', body=u'b'))
+        form.populate_obj(entry)
+        self.assertEqual(entry.slug, u'second-take')
+
+        self.session.add(entry)
+        self.session.flush()
+        self.session.expunge_all()
+        found = self.session.query(BlogRecord).filter(
+            BlogRecord.slug == u'second-take').one()
+        self.assertEqual(found.title, u'Second Take')
+
+    def test_long_slug_keeps_whole_escapes(self):
+        from .models.blog_record import make_slug
+
+        slug = make_slug(u'ż' * 255)
+        self.assertLessEqual(len(slug), 255)
+        self.assertTrue(slug.endswith(u'%C5%BC'))
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        from .cache import LRUCache
+
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {'size': 2, 'hits': 2, 'misses': 1,
+                                         'evictions': 1})
+
+    def test_ttl(self):
+        from .cache import LRUCache
+
+        now = [0]
+        cache = LRUCache(2, ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 9
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 10
+        self.assertIsNone(cache.get('a'))
+
+
+class TestFragmentCache(unittest.TestCase):
+
+    def setUp(self):
+        import jinja2
+
+        self.config = testing.setUp()
+        self.config.include('pyramid_jinja2')
+        self.config.include('.cache')
+        self.cache = self.config.registry['fragment_cache']
+        self.environment = jinja2.Environment(
+            autoescape=True,
+            extensions=['pyramid_blogr.cache.FragmentCacheExtension'])
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _render(self, source, **context):
+        template = self.environment.from_string(source)
+        return template.render(request=testing.DummyRequest(), **context)
+
+    def test_fragment_is_rendered_once(self):
+        source = ("{% cache 'entry', entry.id %}<b>{{ entry.title }}</b>"
+                  "{% endcache %}|{{ entry.title }}")
+        entry = testing.DummyResource(id=1, title=u'<one>')
+        self.assertEqual(self._render(source, entry=entry),
+                         u'<b>&lt;one&gt;</b>|&lt;one&gt;')
+        entry.title = u'two'
+        self.assertEqual(self._render(source, entry=entry),
+                         u'<b>&lt;one&gt;</b>|two')
+
+    def test_entry_changes_evict_fragments(self):
+        from .models.events import EntriesChanged
+
+        self.cache.set(('entries', 'http://example.com/'), u'list')
+        self.cache.set(('entry', 1), u'one')
+        self.cache.set(('entry', 2), u'two')
+        self.cache.set(('layout', 'footer'), u'footer')
+        self.config.registry.notify(EntriesChanged(
+            self.config.registry, set(), {2}, set()))
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get(('entry', 1)), u'one')
+        self.assertEqual(self.cache.get(('layout', 'footer')), u'footer')
+
+
+class TestConditionalGet(BaseTest):
+
+    def setUp(self):
+        super(TestConditionalGet, self).setUp()
+        self.init_database()
+
+        from .models.blog_record import BlogRecord
+
+        self.entry = BlogRecord(title=u'one', body=u'body')
+        self.session.add(self.entry)
+        self.session.flush()
+
+    def _request(self, path='/', **headers):
+        from pyramid.request import Request
+
+        request = Request.blank(path, headers=headers)
+        request.registry = self.config.registry
+        request.dbsession = self.session
+        return request
+
+    def _view(self, **headers):
+        from .views.blog import blog_view
+
+        request = self._request('/blog/1/one', **headers)
+        request.matchdict = {'id': str(self.entry.id), 'slug': u'one'}
+        return request, blog_view(request)
+
+    def test_blog_view_sets_validators(self):
+        request, info = self._view()
+        self.assertIs(info['entry'], self.entry)
+        self.assertTrue(request.response.etag)
+        self.assertEqual(request.response.last_modified.replace(tzinfo=None),
+                         self.entry.edited.replace(microsecond=0))
+
+    def test_blog_view_not_modified(self):
+        request, info = self._view()
+        etag = request.response.etag
+        self.session.expunge_all()
+        with capture_statements(self.engine) as statements:
+            request, response = self._view(
+                **{'If-None-Match': '"%s"' % etag})
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.etag, etag)
+        # answered without loading the body
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('body', statements[0])
+
+    def test_blog_view_modified_since(self):
+        import datetime
+        from webob.datetime_utils import serialize_date
+
+        since = serialize_date(self.entry.edited)
+        request, response = self._view(**{'If-Modified-Since': since})
+        self.assertEqual(response.status_int, 304)
+
+        self.entry.edited += datetime.timedelta(seconds=5)
+        self.session.flush()
+        request, info = self._view(**{'If-Modified-Since': since})
+        self.assertIs(info['entry'], self.entry)
+
+    def test_index_page_etag_follows_entries(self):
+        from .views.default import index_page
+
+        request = self._request()
+        index_page(request)
+        etag = request.response.etag
+        self.assertIn('Cookie', request.response.vary)
+
+        response = index_page(self._request(
+            **{'If-None-Match': '"%s"' % etag}))
+        self.assertEqual(response.status_int, 304)
+
+        self.entry.title = u'renamed'
+        self.session.flush()
+        request = self._request(**{'If-None-Match': '"%s"' % etag})
+        info = index_page(request)
+        self.assertEqual(info['paginator'].items[0].title, u'renamed')
+        self.assertNotEqual(request.response.etag, etag)
+
+    def test_index_page_listing_follows_other_writers(self):
+        from .models.blog_record import BlogRecord
+        from .views.default import index_page
+
+        listing = index_page(self._request())['listing']
+        # as written by blogr_import or another worker: no events here
+        self.session.execute(BlogRecord.__table__.insert().values(
+            title=u'imported', slug=u'imported'))
+        self.assertNotEqual(index_page(self._request())['listing'], listing)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp(settings={
+            'blogr.response_cache.size': '10',
+        })
+        self.config.include('pyramid_jinja2')
+        self.config.include('.routes')
+        self.config.include('.cache')
+        self.cache = self.config.registry['response_cache']
+        self.calls = []
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _handler(self, request):
+        from pyramid.response import Response
+
+        self.calls.append(request.path_qs)
+        return Response(u'page %d' % len(self.calls), etag='tag')
+
+    def _get(self, path, method='GET', userid=None, **headers):
+        from pyramid.request import Request
+        from .cache import response_cache_tween_factory
+
+        self.config.testing_securitypolicy(userid=userid)
+        request = Request.blank(path, method=method, headers=headers)
+        request.registry = self.config.registry
+        tween = response_cache_tween_factory(self._handler,
+                                             self.config.registry)
+        return tween(request)
+
+    def test_anonymous_pages_are_cached(self):
+        self.assertEqual(self._get('/').headers['X-Cache'], 'MISS')
+        response = self._get('/')
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(response.text, u'page 1')
+        self.assertEqual(self._get('/?page=2').text, u'page 2')
+        self.assertEqual(self._get('/blog/1/one').text, u'page 3')
+        self.assertEqual(self._get('/blog/1/one').text, u'page 3')
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+    def test_bypassed_requests(self):
+        self._get('/', userid=u'admin')
+        self._get('/', userid=u'admin')
+        self._get('/blog/create')
+        self._get('/blog/create')
+        self._get('/', method='POST')
+        self.assertEqual(len(self.calls), 5)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_cached_response_answers_conditional_get(self):
+        from webob import Request
+
+        self._get('/')
+        request = Request.blank('/', headers={'If-None-Match': '"tag"'})
+        response = request.get_response(self._get('/'))
+        self.assertEqual(response.status_int, 304)
+
+    def test_entry_changes_evict_responses(self):
+        from .models.events import EntriesChanged
+
+        self._get('/')
+        self._get('/blog/1/one')
+        self._get('/blog/2/two')
+        self.config.registry.notify(EntriesChanged(
+            self.config.registry, set(), {1}, set()))
+        self.assertEqual(self._get('/blog/2/two').headers['X-Cache'], 'HIT')
+        self.assertEqual(self._get('/blog/1/one').headers['X-Cache'], 'MISS')
+        self.assertEqual(self._get('/').headers['X-Cache'], 'MISS')
+
+    def test_response_rendered_across_a_write_is_not_kept(self):
+        from .models.events import EntriesChanged
+
+        render = self._handler
+
+        def handler(request):
+            response = render(request)
+            self.config.registry.notify(EntriesChanged(
+                self.config.registry, {3}, set(), set()))
+            return response
+
+        self._handler = handler
+        self._get('/')
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestFeed(BaseTest):
+
+    def setUp(self):
+        super(TestFeed, self).setUp()
+        self.init_database()
+        self.config.include('pyramid_jinja2')
+        self.config.include('.routes')
+        self.config.include('.cache')
+
+        from .models import get_session_factory
+        from .models.blog_record import BlogRecord
+        from .models.events import track_entry_changes
+
+        session_factory = get_session_factory(self.engine)
+        self.config.registry['dbsession_factory'] = session_factory
+        track_entry_changes(session_factory, self.config.registry)
+        for i in range(3):
+            self.session.add(BlogRecord(title=u'entry <%d>' % i,
+                                        body=u'body & %d' % i))
+        transaction.commit()
+
+    def _get(self, **headers):
+        from pyramid.request import Request
+        from .views.feed import feed_view
+
+        request = Request.blank('/feed.atom', headers=headers)
+        request.registry = self.config.registry
+        request.dbsession = self.session
+        request.dbsession_factory = self.config.registry['dbsession_factory']
+        return feed_view(request)
+
+    def test_feed_is_streamed_and_cached(self):
+        from xml.etree import ElementTree
+
+        response = self._get()
+        self.assertEqual(response.content_type, 'application/atom+xml')
+        self.assertEqual(len(self.config.registry['feed_cache']), 0)
+        body = b''.join(response.app_iter)
+        feed = ElementTree.fromstring(body)
+        atom = '{http://www.w3.org/2005/Atom}'
+        self.assertEqual(
+            [e.find(atom + 'title').text for e in feed.iter(atom + 'entry')],
+            [u'entry <2>', u'entry <1>', u'entry <0>'])
+
+        cached = self._get()
+        self.assertEqual(cached.body, body)
+        self.assertEqual(cached.etag, response.etag)
+
+    def test_conditional_get(self):
+        response = self._get()
+        b''.join(response.app_iter)
+        self.assertEqual(
+            self._get(**{'If-None-Match': '"%s"' % response.etag}).status_int,
+            304)
+
+    def test_writes_clear_the_feed(self):
+        from .models.blog_record import BlogRecord
+
+        b''.join(self._get().app_iter)
+        self.assertEqual(len(self.config.registry['feed_cache']), 1)
+        session = self.config.registry['dbsession_factory']()
+        session.add(BlogRecord(title=u'new', body=u'news'))
+        session.commit()
+        session.close()
+        self.assertEqual(len(self.config.registry['feed_cache']), 0)
+        self.assertIn(b'news', b''.join(self._get().app_iter))
+
+    def test_writes_from_other_processes(self):
+        from .models.blog_record import BlogRecord
+
+        b''.join(self._get().app_iter)
+        # no EntriesChanged event clears the cache for this one
+        with self.engine.begin() as connection:
+            connection.execute(BlogRecord.__table__.insert().values(
+                title=u'elsewhere', body=u'from another worker'))
+        self.assertIn(b'another worker', b''.join(self._get().app_iter))
+
+    def test_empty_feed_is_updated_now(self):
+        from xml.etree import ElementTree
+        from .models.blog_record import BlogRecord
+
+        self.session.query(BlogRecord).delete()
+        transaction.commit()
+        feed = ElementTree.fromstring(b''.join(self._get().app_iter))
+        updated = feed.find('{http://www.w3.org/2005/Atom}updated').text
+        self.assertRegex(updated, r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ$')
+
+
+class TestExport(BaseTest):
+
+    def setUp(self):
+        super(TestExport, self).setUp()
+        self.init_database()
+        self.add_entries(5, body=u'line one\nline, "two"')
+
+    def test_batches_are_bounded(self):
+        from .services.export import iter_entry_batches
+
+        with self.engine.connect() as connection:
+            batches = list(iter_entry_batches(connection, batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual([row.id for batch in batches for row in batch],
+                         [1, 2, 3, 4, 5])
+
+    def test_ndjson(self):
+        import json
+        from .services.export import export_entries
+
+        chunks = list(export_entries(self.engine, 'ndjson', batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        rows = [json.loads(line) for line in
+                b''.join(chunks).decode('utf-8').splitlines()]
+        self.assertEqual(rows[4]['title'], u'entry 4')
+        self.assertEqual(rows[4]['body'], u'line one\nline, "two"')
+
+    def test_csv(self):
+        import csv
+        import io
+        from .services.export import export_entries
+
+        data = b''.join(export_entries(self.engine, 'csv', batch_size=2))
+        rows = list(csv.DictReader(io.StringIO(data.decode('utf-8'))))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['slug'], u'entry-0')
+        self.assertEqual(rows[0]['body'], u'line one\nline, "two"')
+
+    def test_empty_csv_has_header(self):
+        from .services.export import EXPORT_COLUMNS, encode_csv
+
+        self.assertEqual(b''.join(encode_csv([])).decode('utf-8').strip(),
+                         u','.join(EXPORT_COLUMNS))
+
+
+WXR_SAMPLE = b'''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"
+    xmlns:content="http://purl.org/rss/1.0/modules/content/"
+    xmlns:wp="http://wordpress.org/export/1.2/">
+<channel>
+    <title>Old blog</title>
+    <item>
+        <title>First post</title>
+        <content:encoded><![CDATA[<p>Hello</p>]]></content:encoded>
+        <wp:post_date_gmt>2015-03-01 10:00:00</wp:post_date_gmt>
+        <wp:post_modified_gmt>2015-03-02 11:00:00</wp:post_modified_gmt>
+        <wp:post_type>post</wp:post_type>
+    </item>
+    <item>
+        <title>About</title>
+        <content:encoded>A page</content:encoded>
+        <wp:post_type>page</wp:post_type>
+    </item>
+    <item>
+        <title>Draft</title>
+        <content:encoded>Later</content:encoded>
+        <wp:post_date_gmt>0000-00-00 00:00:00</wp:post_date_gmt>
+        <wp:post_type>post</wp:post_type>
+    </item>
+</channel>
+</rss>
+'''
+
+
+class TestBatches(BaseTest):
+
+    def setUp(self):
+        super(TestBatches, self).setUp()
+        self.init_database()
+        self.add_entries(5)
+
+    def test_pk_batches(self):
+        import sqlalchemy as sa
+        from .models.blog_record import BlogRecord
+        from .services.batch import iter_pk_batches
+
+        table = BlogRecord.__table__
+        query = sa.select(table.c.id).where(table.c.id != 2)
+        with self.engine.connect() as connection:
+            for bind in (self.engine, connection):
+                self.assertEqual(
+                    [[row.id for row in batch] for batch in
+                     iter_pk_batches(bind, query, table.c.id, 2)],
+                    [[1, 3], [4, 5]])
+
+    def test_chunked(self):
+        from .services.batch import chunked
+
+        self.assertEqual(list(chunked(iter(range(5)), 2)),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+    def test_commit_batches(self):
+        import operator
+        import sqlalchemy as sa
+        from .models.blog_record import BlogRecord
+        from .services.batch import commit_batches, iter_pk_batches
+
+        table = BlogRecord.__table__
+        update = (table.update()
+                  .where(table.c.id == sa.bindparam('_id'))
+                  .values(body=sa.bindparam('_body')))
+
+        def write(connection, batch, bodies):
+            connection.execute(update, [
+                {'_id': row.id, '_body': body}
+                for row, body in zip(batch, bodies)])
+
+        for workers in (0, 2):
+            batches = iter_pk_batches(
+                self.engine, sa.select(table.c.id, table.c.body),
+                table.c.id, 2)
+            committed = list(commit_batches(
+                self.engine, batches, write, str.upper,
+                key=operator.attrgetter('body'), workers=workers))
+            self.assertEqual([len(batch) for batch in committed], [2, 2, 1])
+        self.assertEqual(
+            self.session.query(BlogRecord.body).order_by(BlogRecord.id)
+            .first(), (u'BODY 0',))
+
+    def test_failed_batch_is_rolled_back(self):
+        from .models.blog_record import BlogRecord
+        from .services.batch import commit_batches
+
+        table = BlogRecord.__table__
+
+        def write(connection, batch, results):
+            connection.execute(table.delete().where(table.c.id.in_(batch)))
+            if 4 in batch:
+                raise ValueError(batch)
+
+        with self.assertRaises(ValueError):
+            list(commit_batches(self.engine, [[1, 2], [3, 4]], write))
+        self.assertEqual(
+            [id for id, in self.session.query(BlogRecord.id)], [3, 4, 5])
+
+
+class TestImport(BaseTest):
+
+    def setUp(self):
+        super(TestImport, self).setUp()
+        self.init_database()
+
+        import tempfile
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp)
+        super(TestImport, self).tearDown()
+
+    def _entries(self):
+        from .models.blog_record import BlogRecord
+
+        self.session.expunge_all()
+        return self.session.query(BlogRecord).order_by(BlogRecord.id).all()
+
+    def test_wxr(self):
+        import datetime
+        import io
+        from .services.importer import import_entries, parse_wxr
+
+        count = import_entries(self.engine, parse_wxr(io.BytesIO(WXR_SAMPLE)))
+        self.assertEqual(count, 2)
+        first, draft = self._entries()
+        self.assertEqual(first.title, u'First post')
+        self.assertEqual(first.slug, u'first-post')
+        self.assertEqual(first.body, u'<p>Hello</p>')
+        self.assertEqual(first.created, datetime.datetime(2015, 3, 1, 10))
+        self.assertEqual(first.edited, datetime.datetime(2015, 3, 2, 11))
+        self.assertEqual(draft.edited, draft.created)
+
+    def test_csv(self):
+        import io
+        from .services.importer import import_entries, parse_csv
+
+        data = (u'title,body,created\r\n'
+                u'"One, two",body,2019-01-01T00:00:00Z\r\n'
+                u',skipped,\r\n').encode('utf-8')
+        import_entries(self.engine, parse_csv(io.BytesIO(data)))
+        self.assertEqual([e.title for e in self._entries()], [u'One, two'])
+
+    def test_csv_round_trip_of_large_body(self):
+        import io
+        from .models.blog_record import BlogRecord
+        from .services.export import export_entries
+        from .services.importer import import_entries, parse_csv
+
+        body = u'x' * (200 * 1024)
+        self.add_entries(1, title=u'long', body=body)
+        data = b''.join(export_entries(self.engine, 'csv'))
+        self.session.delete(self.session.query(BlogRecord).one())
+        transaction.commit()
+
+        import_entries(self.engine, parse_csv(io.BytesIO(data)))
+        entry, = self._entries()
+        self.assertEqual(entry.title, u'long')
+        self.assertEqual(entry.body, body)
+
+    def test_posts_during_import(self):
+        import io
+        import json
+        import os
+        from sqlalchemy import event
+        from .models import get_engine, get_session_factory
+        from .models.blog_record import BlogRecord
+        from .models.meta import Base
+        from .services.importer import import_entries, parse_ndjson
+
+        # the post comes from a connection of its own, which an in-memory
+        # database can't give
+        engine = get_engine({'sqlalchemy.url': 'sqlite:///' + os.path.join(
+            self.tmp, 'db.sqlite')})
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(engine)
+        factory = get_session_factory(engine)
+        posted = []
+
+        def post(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT INTO entries ') and not posted:
+                posted.append(True)
+                session = factory()
+                session.add(BlogRecord(title=u'web', body=u'posted'))
+                session.commit()
+                session.close()
+
+        event.listen(engine, 'before_cursor_execute', post)
+        data = u''.join(json.dumps({'title': title, 'body': u'imported'})
+                        + u'\n' for title in (u'a', u'b')).encode('utf-8')
+        self.assertEqual(
+            import_entries(engine, parse_ndjson(io.BytesIO(data))), 2)
+        self.assertTrue(posted)
+        with engine.connect() as connection:
+            self.assertEqual(sorted(connection.exec_driver_sql(
+                "SELECT title FROM entries_fts WHERE entries_fts MATCH "
+                "'imported OR posted'").scalars()), [u'a', u'b', u'web'])
+
+    def test_resumes_from_checkpoint(self):
+        import io
+        import json
+        import os
+        from sqlalchemy.exc import IntegrityError
+        from .services.importer import (
+            import_entries,
+            parse_ndjson,
+            read_checkpoint,
+            )
+
+        checkpoint = os.path.join(self.tmp, 'import.checkpoint')
+        titles = [u'a', u'b', u'c', u'a', u'd']
+        data = u''.join(json.dumps({'title': title, 'body': u'x'}) + u'\n'
+                        for title in titles).encode('utf-8')
+
+        # the duplicate title fails the second batch of two...
+        with self.assertRaises(IntegrityError):
+            import_entries(self.engine, parse_ndjson(io.BytesIO(data)),
+                           batch_size=2, checkpoint=checkpoint)
+        self.assertEqual(read_checkpoint(checkpoint), 2)
+        self.assertEqual([e.title for e in self._entries()], [u'a', u'b'])
+
+        # ...which is picked up again once duplicates are skipped
+        count = import_entries(self.engine, parse_ndjson(io.BytesIO(data)),
+                               batch_size=2, checkpoint=checkpoint,
+                               skip_duplicates=True)
+        self.assertEqual(count, 5)
+        self.assertEqual([e.title for e in self._entries()],
+                         [u'a', u'b', u'c', u'd'])
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_checkpoint_of_finished_import_is_removed(self):
+        import io
+        import json
+        import os
+        from .services.importer import import_entries, parse_ndjson
+
+        checkpoint = os.path.join(self.tmp, 'import.checkpoint')
+        for titles in ([u'a', u'b'], [u'c', u'd', u'e']):
+            data = u''.join(json.dumps({'title': title, 'body': u'x'})
+                            + u'\n' for title in titles).encode('utf-8')
+            # the same file name for another dump starts over
+            self.assertEqual(import_entries(
+                self.engine, parse_ndjson(io.BytesIO(data)), batch_size=2,
+                checkpoint=checkpoint), len(titles))
+            self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual([e.title for e in self._entries()],
+                         [u'a', u'b', u'c', u'd', u'e'])
+
+
+class TestSearch(BaseTest):
+
+    def setUp(self):
+        super(TestSearch, self).setUp()
+        self.init_database()
+        self.config.add_route('search', '/search')
+
+        from .models.blog_record import BlogRecord
+
+        self.entries = [
+            BlogRecord(title=u'Pyramid tips', body=u'Traversal or routes?'),
+            BlogRecord(title=u'Gardening', body=u'Pyramid shaped <b>hedges'),
+            BlogRecord(title=u'Cooking', body=u'Nothing to see here'),
+        ]
+        self.session.add_all(self.entries)
+        self.session.flush()
+
+    def _search(self, terms, after=None, **kw):
+        from .services.blog_record import BlogRecordService
+
+        request = self.route_request('search', q=terms)
+        return BlogRecordService.search(request, terms, after=after, **kw)
+
+    def test_title_matches_rank_first(self):
+        page = self._search(u'pyramid')
+        self.assertEqual([r.id for r in page.items],
+                         [self.entries[0].id, self.entries[1].id])
+        self.assertEqual(page.items[0].title_html,
+                         u'<mark>Pyramid</mark> tips')
+        # the body is escaped around the highlighted words
+        self.assertEqual(page.items[1].snippet_html,
+                         u'<mark>Pyramid</mark> shaped &lt;b&gt;hedges')
+
+    def test_terms_are_not_query_syntax(self):
+        self.assertEqual(self._search(u'"cook* OR').items, [])
+        self.assertEqual(self._search(u'  ').items, [])
+        # AND is looked for as a word rather than taken as an operator
+        self.assertEqual(self._search(u'pyramid AND').items, [])
+        self.assertEqual(len(self._search(u'pyramid, hedges!').items), 1)
+
+    def test_next_page(self):
+        page = self._search(u'pyramid', items_per_page=1)
+        self.assertEqual([r.id for r in page.items], [self.entries[0].id])
+        self.assertTrue(page.next_cursor)
+        self.assertIn('q=pyramid', page.pager())
+
+        page = self._search(u'pyramid', after=page.next_cursor,
+                            items_per_page=1)
+        self.assertEqual([r.id for r in page.items], [self.entries[1].id])
+        self.assertIsNone(page.next_cursor)
+
+    def test_index_follows_changes(self):
+        cooking = self.entries[2]
+        cooking.body = u'Pyramid cake'
+        self.session.delete(self.entries[1])
+        self.session.flush()
+        self.assertEqual([r.id for r in self._search(u'pyramid').items],
+                         [self.entries[0].id, cooking.id])
+        self.assertEqual(self._search(u'hedges').items, [])
+
+    def test_imported_entries_are_indexed(self):
+        from .services.importer import import_entries
+
+        transaction.commit()
+        import_entries(self.engine, [{'title': u'Imported',
+                                      'body': u'About pyramids'}])
+        self.assertEqual([r.title for r in self._search(u'pyramids').items],
+                         [u'Imported'])
+
+
+class TestMarkdown(BaseTest):
+
+    def setUp(self):
+        super(TestMarkdown, self).setUp()
+        self.init_database()
+
+    def _add(self, title, body):
+        from .models.blog_record import BlogRecord
+
+        entry = BlogRecord(title=title, body=body)
+        self.session.add(entry)
+        self.session.flush()
+        return entry
+
+    def test_render_is_safe(self):
+        from .markup import render
+
+        self.assertEqual(render(u'*hi* <script>x</script>'),
+                         u'<p><em>hi</em> &lt;script&gt;x&lt;/script&gt;</p>')
+        self.assertEqual(
+            render(u'[a](javascript:x) [b](java&#115;cript:x) [c](/blog/1)'),
+            u'<p><a>a</a> <a>b</a> <a href="/blog/1">c</a></p>')
+
+    def test_create_renders_body(self):
+        from webob.multidict import MultiDict
+        from .markup import RENDERER_VERSION
+        from .models.blog_record import BlogRecord
+        from .views.blog import blog_create
+
+        self.config.add_route('home', '/')
+        request = dummy_request(self.session)
+        request.method = 'POST'
+        request.POST = MultiDict(title=u'one', body=u'**bold**')
+        request.matchdict = {'action': 'create'}
+        blog_create(request)
+        entry = self.session.query(BlogRecord).one()
+        self.assertEqual(entry.body_html, u'<p><strong>bold</strong></p>')
+        self.assertEqual(entry.body_html_version, RENDERER_VERSION)
+
+    def test_view_renders_stale_entries(self):
+        from .markup import RENDERER_VERSION
+        from .services.blog_record import BlogRecordService
+
+        entry = self._add(u'one', u'*new*')
+        entry.body_html = u'<p>old</p>'
+        entry.body_html_version = RENDERER_VERSION - 1
+        self.session.flush()
+        edited = entry.edited
+        self.session.expunge_all()
+
+        request = dummy_request(self.session)
+        entry = BlogRecordService.by_id(entry.id, request)
+        BlogRecordService.render_stale(request, entry)
+        self.assertEqual(entry.body_html, u'<p><em>new</em></p>')
+        self.session.expunge_all()
+
+        entry = BlogRecordService.by_id(entry.id, request)
+        self.assertFalse(entry.body_html_stale)
+        self.assertEqual(entry.body_html, u'<p><em>new</em></p>')
+        # re-rendering is not an edit
+        self.assertEqual(entry.edited, edited)
+
+    def test_rerender_entries(self):
+        from .markup import RENDERER_VERSION
+        from .models.blog_record import BlogRecord
+        from .services.rerender import rerender_entries
+
+        self._add(u'fresh', u'a').render_body()
+        self.add_entries(5, title=u'stale {}', body=u'*{}*')
+
+        for workers in (0, 2):
+            self.assertEqual(rerender_entries(self.engine, batch_size=2,
+                                              workers=workers), 5)
+            self.session.query(BlogRecord).update(
+                {BlogRecord.body_html_version: None})
+            self.session.query(BlogRecord).filter(
+                BlogRecord.title == u'fresh').update(
+                    {BlogRecord.body_html_version: RENDERER_VERSION})
+            transaction.commit()
+
+        self.assertEqual(rerender_entries(self.engine, workers=0, force=True),
+                         6)
+        self.assertEqual(
+            self.session.query(BlogRecord.body_html).filter(
+                BlogRecord.title == u'stale 3').scalar(),
+            u'<p><em>3</em></p>')
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def _hasher(self, backend, **kw):
+        from passlib.context import CryptContext
+        from .passwords import PasswordHasher
+
+        # cheap rounds keep the tests quick
+        context = CryptContext(schemes=['sha256_crypt'],
+                               sha256_crypt__default_rounds=1000)
+        hasher = PasswordHasher(context, backend=backend, **kw)
+        self.addCleanup(hasher.shutdown)
+        return hasher
+
+    def test_backends(self):
+        for backend in ('inline', 'thread', 'process'):
+            hasher = self._hasher(backend, workers=1)
+            password_hash = hasher.hash(u'secret')
+            self.assertTrue(password_hash.startswith('$5$rounds=1000$'))
+            self.assertTrue(hasher.verify(u'secret', password_hash))
+            self.assertFalse(hasher.verify(u'guess', password_hash))
+
+    def test_default_limit_leaves_server_threads(self):
+        # waitress serves with 4 threads unless told otherwise
+        self.assertLess(self._hasher('thread').limit, 4)
+
+    def test_busy_when_queue_is_full(self):
+        import threading
+        import time
+        from . import passwords
+
+        release = threading.Event()
+        original = passwords.call_context
+
+        def slow_call(*args):
+            release.wait(5)
+            return original(*args)
+
+        passwords.call_context = slow_call
+        self.addCleanup(setattr, passwords, 'call_context', original)
+
+        hasher = self._hasher('thread', workers=1, queue_size=1)
+        threads = [threading.Thread(target=hasher.hash, args=(u'x',))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        try:
+            while hasher.pending < 2:
+                time.sleep(0.001)
+            with self.assertRaises(passwords.HashingBusy):
+                hasher.hash(u'y')
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+        # slots are given back once operations finish
+        self.assertEqual(hasher.pending, 0)
+        self.assertTrue(hasher.hash(u'z'))
+
+    def test_busy_view(self):
+        from .views.unavailable import hashing_busy_view
+
+        response = hashing_busy_view(testing.DummyRequest())
+        self.assertEqual(response.status_int, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+    def test_user_uses_hasher(self):
+        from .models.user import User
+
+        hasher = self._hasher('thread', workers=1)
+        user = User(name=u'u', password=u'')
+        user.set_password(u'secret', hasher)
+        self.assertTrue(user.password.startswith('$5$rounds=1000$'))
+        self.assertTrue(user.verify_password(u'secret', hasher))
+
+
+class TestCleartextPasswords(BaseTest):
+
+    def setUp(self):
+        super(TestCleartextPasswords, self).setUp()
+        self.init_database()
+
+        from passlib.context import CryptContext
+
+        self.context = CryptContext(schemes=['sha256_crypt'],
+                                    sha256_crypt__default_rounds=1000)
+
+    def _users(self, *names):
+        from .models.user import User
+
+        self.session.add_all(User(name=name, password=name + u'-pw')
+                             for name in names)
+        transaction.commit()
+
+    def _passwords(self):
+        from .models.user import User
+
+        return dict(self.session.query(User.name, User.password))
+
+    def test_hashes_cleartext_passwords(self):
+        from .models.user import User
+        from .services.rehash import hash_cleartext_passwords
+
+        self._users(u'a', u'b')
+        hashed = self.context.hash(u'c-pw')
+        self.session.add(User(name=u'c', password=hashed))
+        transaction.commit()
+        self.assertEqual(hash_cleartext_passwords(
+            self.engine, self.context, batch_size=2, workers=0), 2)
+
+        self._users(u'd')
+        self.assertEqual(hash_cleartext_passwords(
+            self.engine, self.context, workers=2), 1)
+        self.assertEqual(hash_cleartext_passwords(
+            self.engine, self.context, workers=0), 0)
+
+        passwords = self._passwords()
+        self.assertEqual(passwords[u'c'], hashed)
+        for name in (u'a', u'b', u'd'):
+            self.assertTrue(self.context.verify(name + u'-pw',
+                                                passwords[name]))
+
+    def test_cleartext_sign_in_is_opt_in(self):
+        from .models.user import User
+        from .passwords import PasswordHasher
+
+        self._users(u'a')
+        user = self.session.query(User).one()
+        self.assertFalse(user.verify_password(
+            u'a-pw', PasswordHasher(self.context, backend='inline')))
+        self.assertEqual(user.password, u'a-pw')
+
+        hasher = PasswordHasher(self.context, backend='inline',
+                                cleartext=True)
+        calls = []
+
+        def run(method, *args):
+            calls.append(method)
+            return PasswordHasher._run(hasher, method, *args)
+
+        hasher._run = run
+        self.assertTrue(user.verify_password(u'a-pw', hasher))
+        self.assertTrue(user.password.startswith('$5$'))
+        # the password is hashed once, not verified against its new hash
+        self.assertEqual(calls, ['hash'])
+
+
+class TestHashCalibration(unittest.TestCase):
+
+    def test_calibrate_rounds(self):
+        import itertools
+        from passlib.context import CryptContext
+        from .passwords import calibrate_rounds
+
+        context = CryptContext(schemes=['sha256_crypt'])
+        # every probe hash of 535000 // 8 rounds "takes" 50ms
+        ticks = itertools.count(step=0.05)
+        rounds = calibrate_rounds(context, target=0.2,
+                                  timer=lambda: next(ticks))
+        self.assertEqual(rounds, 535000 // 8 * 4)
+
+    def test_weaker_hashes_are_upgraded_on_sign_in(self):
+        from passlib.context import CryptContext
+        from .models.user import User
+        from .passwords import PasswordHasher, calibrated_context
+
+        context = CryptContext(schemes=['sha256_crypt'],
+                               sha256_crypt__default_rounds=1000)
+        user = User(name=u'u', password=context.hash(u'secret'))
+        old_hash = user.password
+
+        hasher = PasswordHasher(calibrated_context(context, 2000),
+                                backend='inline')
+        self.assertFalse(user.verify_password(u'guess', hasher))
+        self.assertEqual(user.password, old_hash)
+        self.assertTrue(user.verify_password(u'secret', hasher))
+        self.assertTrue(user.password.startswith('$5$rounds=2000$'))
+
+        # hashes stronger than asked for are left alone
+        hasher = PasswordHasher(calibrated_context(context, 1200),
+                                backend='inline')
+        new_hash = user.password
+        self.assertTrue(user.verify_password(u'secret', hasher))
+        self.assertEqual(user.password, new_hash)
+
+
+class TestLoginThrottle(BaseTest):
+
+    def setUp(self):
+        super(TestLoginThrottle, self).setUp()
+        self.init_database()
+        self.config.add_route('home', '/')
+
+        from .throttle import LoginThrottle, TokenBuckets
+
+        self.now = 0.0
+        self.buckets = TokenBuckets(maxsize=3, clock=lambda: self.now)
+        self.throttle = LoginThrottle(
+            self.buckets, username_burst=2, username_per_minute=6,
+            address_burst=3, address_per_minute=60)
+
+    def test_token_bucket(self):
+        self.assertEqual(self.throttle.attempt(u'Bob', '10.0.0.1'), 0)
+        self.assertEqual(self.throttle.attempt(u' bob', '10.0.0.2'), 0)
+        # 6 a minute is one every 10 seconds
+        self.assertEqual(self.throttle.attempt(u'BOB', '10.0.0.3'), 10)
+        self.now += 10
+        self.assertEqual(self.throttle.attempt(u'bob', '10.0.0.4'), 0)
+
+    def test_address_bucket(self):
+        for name in (u'a', u'b', u'c'):
+            self.assertEqual(self.throttle.attempt(name, '10.0.0.1'), 0)
+        self.assertEqual(self.throttle.attempt(u'd', '10.0.0.1'), 1)
+
+    def test_bounded(self):
+        for i in range(10):
+            self.buckets.take(i, 1, 1)
+        self.assertEqual(len(self.buckets), 3)
+
+    def test_client_address(self):
+        from .throttle import LoginThrottle
+
+        throttle = LoginThrottle(self.buckets, trusted_proxies=['10.0.0.9'])
+        request = dummy_request(self.session)
+        request.remote_addr = '10.0.0.1'
+        request.headers['X-Forwarded-For'] = '192.0.2.1'
+        # anyone can send the header...
+        self.assertEqual(throttle.client_address(request), '10.0.0.1')
+        # ...but the proxy appends the address it got the request from
+        request.remote_addr = '10.0.0.9'
+        request.headers['X-Forwarded-For'] = '192.0.2.1, 198.51.100.7'
+        self.assertEqual(throttle.client_address(request), '198.51.100.7')
+        del request.headers['X-Forwarded-For']
+        self.assertEqual(throttle.client_address(request), '10.0.0.9')
+
+    def test_rejected_before_lookup(self):
+        from webob.multidict import MultiDict
+        from .views.default import sign_in_out
+
+        self.config.registry['login_throttle'] = self.throttle
+        request = dummy_request(self.session)
+        request.POST = MultiDict(username=u'bob', password=u'x')
+        request.remote_addr = '10.0.0.1'
+        for i in range(2):
+            self.assertEqual(sign_in_out(request).status_int, 302)
+        with capture_statements(self.engine) as statements:
+            response = sign_in_out(request)
+        self.assertEqual(response.status_int, 429)
+        self.assertEqual(response.headers['Retry-After'], '10')
+        self.assertEqual(statements, [])
+
+
+class TestTicketCache(BaseTest):
+
+    def _policy(self, **kw):
+        from .cache import LRUCache
+        from .security import CachingAuthTktAuthenticationPolicy
+
+        policy = CachingAuthTktAuthenticationPolicy(
+            'secret', ticket_cache=LRUCache(10), **kw)
+        identify = policy.cookie.identify
+        self.identified = 0
+
+        def counting_identify(request):
+            self.identified += 1
+            return identify(request)
+
+        policy.cookie.identify = counting_identify
+        return policy
+
+    def _request(self, policy, userid=u'bob'):
+        from pyramid.request import Request
+
+        request = Request.blank('/')
+        cookie = policy.remember(request, userid)[0][1].split(';')[0]
+        request = Request.blank('/', headers={'Cookie': cookie})
+        request.registry = self.config.registry
+        request.dbsession = self.session
+        return request
+
+    def test_verified_once(self):
+        policy = self._policy()
+        request = self._request(policy)
+        for i in range(3):
+            self.assertEqual(policy.unauthenticated_userid(request), u'bob')
+        self.assertEqual(self.identified, 1)
+
+        # a later request with the same cookie
+        request = self._request(policy)
+        self.assertEqual(policy.unauthenticated_userid(request), u'bob')
+        self.assertEqual(request.environ['AUTH_TYPE'], 'cookie')
+        self.assertEqual(self.identified, 1)
+
+    def test_forged_tickets_are_not_cached(self):
+        from pyramid.request import Request
+
+        policy = self._policy()
+        for i in range(2):
+            request = Request.blank('/', headers={'Cookie': 'auth_tkt=junk'})
+            self.assertIsNone(policy.unauthenticated_userid(request))
+        self.assertEqual(self.identified, 2)
+
+    def test_timeout_applies_to_cached_tickets(self):
+        policy = self._policy(timeout=60)
+        request = self._request(policy)
+        import time
+
+        self.assertEqual(policy.unauthenticated_userid(request), u'bob')
+        policy.cookie.now = time.time() + 61
+        request = request.blank('/', headers={
+            'Cookie': request.headers['Cookie']})
+        self.assertIsNone(policy.unauthenticated_userid(request))
+        self.assertEqual(self.identified, 1)
+
+    def test_not_cached_with_reissue(self):
+        self.assertIsNone(self._policy(timeout=60,
+                                       reissue_time=6).ticket_cache)
+
+    def test_request_user(self):
+        self.init_database()
+        from .models.user import User
+        from .security import get_user
+
+        self.session.add(User(name=u'bob', password=u'x'))
+        self.config.testing_securitypolicy(userid=u'bob')
+        request = dummy_request(self.session)
+        self.assertEqual(get_user(request).name, u'bob')
+        self.config.testing_securitypolicy(userid=None)
+        self.assertIsNone(get_user(dummy_request(self.session)))
+
+
+class TestLastLoginTracker(unittest.TestCase):
+    # flushes happen on other threads, which don't get to see an in-memory
+    # database
+
+    def setUp(self):
+        import datetime
+        import os
+        import tempfile
+        import sqlalchemy as sa
+        from .models.meta import Base
+        from .models.user import User
+        from .services.user import LastLoginTracker
+
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.engine = sa.create_engine('sqlite:///' + path)
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(self.engine)
+
+        self.start = datetime.datetime(2020, 1, 1)
+        with self.engine.begin() as connection:
+            connection.execute(User.__table__.insert(), [
+                {'name': name, 'password': u'x', 'last_logged': self.start}
+                for name in (u'a', u'b', u'c')])
+        self.tracker = LastLoginTracker(self.engine, interval=3600,
+                                        threshold=3)
+        self.addCleanup(self.tracker.flush)
+
+    def _last_logged(self):
+        from .models.user import User
+
+        with self.engine.connect() as connection:
+            return dict(connection.execute(
+                User.__table__.select().with_only_columns(
+                    User.name, User.last_logged)).fetchall())
+
+    def test_coalesced_batches(self):
+        import datetime
+
+        later = self.start + datetime.timedelta(hours=1)
+        with capture_statements(self.engine) as statements:
+            self.tracker.record(1, later)
+            self.tracker.record(1, later - datetime.timedelta(minutes=5))
+            self.tracker.record(2, later)
+            self.assertEqual(statements, [])
+            self.assertEqual(len(self.tracker), 2)
+            self.tracker.flush()
+        self.assertEqual(len(
+            [s for s in statements if s.startswith('UPDATE')]), 1)
+        self.assertEqual(self._last_logged(),
+                         {u'a': later, u'b': later, u'c': self.start})
+
+    def test_threshold_flushes_in_background(self):
+        import datetime
+        import time
+
+        later = self.start + datetime.timedelta(hours=1)
+        for user_id in (1, 2, 3):
+            self.tracker.record(user_id, later)
+        for i in range(500):
+            if not len(self.tracker) and self._last_logged()[u'c'] == later:
+                break
+            time.sleep(0.01)
+        self.assertEqual(set(self._last_logged().values()), {later})
+
+    def test_failed_flush_backs_off(self):
+        import datetime
+        import sqlalchemy as sa
+        from .services.user import LastLoginTracker
+
+        # no users table
+        broken = sa.create_engine('sqlite://')
+        self.addCleanup(broken.dispose)
+        tracker = LastLoginTracker(broken, interval=60, threshold=2)
+        self.addCleanup(tracker.flush)
+        later = self.start + datetime.timedelta(hours=1)
+
+        tracker.record(1, later)
+        with self.assertLogs('pyramid_blogr.services.user', 'ERROR'):
+            tracker.flush()
+            self.assertEqual(len(tracker), 1)
+            self.assertEqual(tracker._timer.interval, 60)
+            tracker.flush()
+        self.assertEqual(tracker._timer.interval, 120)
+        # reaching the threshold doesn't try again right away
+        tracker.record(2, later)
+        self.assertEqual(tracker._timer.interval, 120)
+
+        tracker.engine = self.engine
+        tracker.flush()
+        self.assertEqual(len(tracker), 0)
+        self.assertIsNone(tracker._timer)
+        self.assertEqual(self._last_logged(),
+                         {u'a': later, u'b': later, u'c': self.start})
+
+    def test_never_goes_back(self):
+        import datetime
+
+        self.tracker.record(1, self.start - datetime.timedelta(days=1))
+        self.tracker.flush()
+        self.assertEqual(self._last_logged()[u'a'], self.start)
+
+
+class TestSQLiteProfile(unittest.TestCase):
+
+    def test_pragmas_and_pool(self):
+        import os
+        import shutil
+        import tempfile
+        from sqlalchemy.pool import QueuePool
+        from .models import get_engine
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        settings = {
+            'sqlalchemy.url': 'sqlite:///' + os.path.join(tmp, 'db.sqlite'),
+            'sqlalchemy.sqlite.journal_mode': 'wal',
+            'sqlalchemy.sqlite.synchronous': 'normal',
+            'sqlalchemy.sqlite.busy_timeout': '1234',
+            'sqlalchemy.sqlite.pool': 'queue',
+            'sqlalchemy.pool_size': '3',
+        }
+        engine = get_engine(settings)
+        self.addCleanup(engine.dispose)
+        # the settings themselves are left alone
+        self.assertIn('sqlalchemy.sqlite.pool', settings)
+        self.assertIsInstance(engine.pool, QueuePool)
+        self.assertEqual(engine.pool.size(), 3)
+        with engine.connect() as connection:
+            pragma = lambda name: connection.exec_driver_sql(
+                'PRAGMA ' + name).scalar()
+            self.assertEqual(pragma('journal_mode'), 'wal')
+            self.assertEqual(pragma('synchronous'), 1)
+            self.assertEqual(pragma('busy_timeout'), 1234)
+
+    def test_bad_settings(self):
+        from .models import get_engine
+
+        for key, value in (('sqlalchemy.sqlite.nonsense', '1'),
+                           ('sqlalchemy.sqlite.synchronous', 'off; x'),
+                           ('sqlalchemy.sqlite.pool', 'deep')):
+            with self.assertRaises(ValueError):
+                get_engine({'sqlalchemy.url': 'sqlite://', key: value})
+
+    def test_pop_settings(self):
+        from .models import sqlite
+
+        pragmas, engine_kw = sqlite.pop_settings({
+            'sqlalchemy.url': 'sqlite://',
+            'sqlalchemy.sqlite.synchronous': 'normal',
+            'sqlalchemy.sqlite.pool': 'null'})
+        self.assertEqual(pragmas, [('synchronous', 'normal')])
+        self.assertEqual(list(engine_kw), ['poolclass'])
+
+    def test_read_only_url(self):
+        from .models.sqlite import read_only_url
+
+        url = read_only_url('sqlite:////tmp/db.sqlite')
+        self.assertEqual(url.database, 'file:/tmp/db.sqlite')
+        self.assertEqual(url.query['mode'], 'ro')
+        for bad in ('sqlite://', 'sqlite:///:memory:',
+                    'postgresql://localhost/blog'):
+            with self.assertRaises(ValueError):
+                read_only_url(bad)
+
+
+class TestGroupCommit(unittest.TestCase):
+    # inserts happen on the committer thread
+
+    def setUp(self):
+        import os
+        import tempfile
+        from sqlalchemy import event
+        from .models import get_engine, get_session_factory
+        from .models.meta import Base
+        from .services.group_commit import GroupCommitter
+
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        engine = get_engine({'sqlalchemy.url': 'sqlite:///' + path})
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(engine)
+        self.factory = get_session_factory(engine)
+        self.commits = []
+        event.listen(self.factory, 'after_commit',
+                     lambda session: self.commits.append(session))
+        self.committer = GroupCommitter(self.factory, window=0.5,
+                                        max_batch=3)
+        self.addCleanup(self.committer.close)
+
+    def _titles(self):
+        from .models.blog_record import BlogRecord
+
+        session = self.factory()
+        try:
+            return sorted(t for t, in session.query(BlogRecord.title))
+        finally:
+            session.close()
+
+    def test_shared_transaction(self):
+        from .models.blog_record import BlogRecord
+
+        futures = [self.committer.submit(BlogRecord(title=title, body=u'b'))
+                   for title in (u'one', u'two', u'three', u'four')]
+        entries = [future.result(5) for future in futures]
+        # max_batch closes the first transaction before the window does
+        self.assertEqual(len(self.commits), 2)
+        self.assertEqual([entry.slug for entry in entries],
+                         [u'one', u'two', u'three', u'four'])
+        self.assertEqual(len({entry.id for entry in entries}), 4)
+        self.assertEqual(self._titles(), [u'four', u'one', u'three', u'two'])
+
+    def test_failures_stay_with_their_request(self):
+        import sqlalchemy as sa
+        from .models.blog_record import BlogRecord
+
+        first = self.committer.submit(BlogRecord(title=u'same', body=u'b'))
+        second = self.committer.submit(BlogRecord(title=u'same', body=u'b'))
+        third = self.committer.submit(BlogRecord(title=u'other', body=u'b'))
+        self.assertEqual(first.result(5).title, u'same')
+        with self.assertRaises(sa.exc.IntegrityError):
+            second.result(5)
+        self.assertEqual(third.result(5).title, u'other')
+        self.assertEqual(self._titles(), [u'other', u'same'])
+
+    def test_close_inserts_pending(self):
+        from .models.blog_record import BlogRecord
+
+        future = self.committer.submit(BlogRecord(title=u'late', body=u'b'))
+        self.committer.close()
+        self.assertTrue(future.done())
+        self.assertEqual(self._titles(), [u'late'])
+
+
+class TestReplicas(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        import shutil
+        import tempfile
+        from sqlalchemy.orm import sessionmaker
+        from .models import (
+            get_engine,
+            get_replica_engines,
+            get_session_factory,
+            )
+        from .models.meta import Base
+        from .models.readonly import READ_ONLY_KEY
+        from .models.replicas import Replicas
+
+        self.config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        self.config.include('.routes')
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        settings = {
+            'sqlalchemy.url': 'sqlite:///' + os.path.join(tmp, 'db.sqlite'),
+            'sqlalchemy.sqlite.journal_mode': 'wal',
+            'blogr.db.replicas': 'read_only',
+        }
+        engine = get_engine(settings)
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(engine)
+        replica, = get_replica_engines(settings)
+        self.addCleanup(replica.dispose)
+        self.primary = get_session_factory(engine)
+        self.replica = sessionmaker(bind=replica, info={READ_ONLY_KEY: True})
+        self.replicas = Replicas(self.primary, [self.replica],
+                                 routes=['home', 'blog'], sticky=5)
+
+    def _request(self, path, route, method='GET', cookies=None, post=None):
+        from pyramid.request import Request
+
+        request = Request.blank(path, method=method, POST=post)
+        request.registry = self.config.registry
+        request.matched_route = self.config.get_routes_mapper().get_route(
+            route)
+        if cookies:
+            request.cookies.update(cookies)
+        return request
+
+    def test_safe_requests_read_from_replicas(self):
+        from .models.readonly import READ_ONLY_KEY
+
+        request = self._request('/', 'home')
+        self.assertIs(self.replicas.factory_for(request), self.replica)
+        self.assertTrue(self.replica().info[READ_ONLY_KEY])
+        for request in (self._request('/', 'home', method='POST'),
+                        self._request('/blog/create', 'blog_action'),
+                        self._request('/feed.atom', 'feed'),
+                        self._request('/', 'home',
+                                      cookies={'blogr_primary': '1'})):
+            self.assertIs(self.replicas.factory_for(request), self.primary)
+
+    def test_sticky_after_write(self):
+        import sqlalchemy as sa
+        from pyramid.response import Response
+        from .models.blog_record import BlogRecord
+
+        def respond(request, write):
+            request.dbsession = self.replicas.factory_for(request)()
+            if write:
+                request.dbsession.add(BlogRecord(title=u'new', body=u'b'))
+            request.dbsession.commit()
+            request.dbsession.close()
+            response = Response()
+            request._process_response_callbacks(response)
+            return response
+
+        response = respond(
+            self._request('/blog/create', 'blog_action', 'POST'), False)
+        self.assertNotIn('blogr_primary', response.headers.get(
+            'Set-Cookie', ''))
+        response = respond(
+            self._request('/blog/create', 'blog_action', 'POST'), True)
+        self.assertIn('blogr_primary=1', response.headers['Set-Cookie'])
+        self.assertIn('Max-Age=5', response.headers['Set-Cookie'])
+
+        # replicas can't be written to
+        session = self.replica()
+        self.addCleanup(session.close)
+        self.assertEqual(session.query(BlogRecord).count(), 1)
+        session.add(BlogRecord(title=u'other', body=u'b'))
+        with self.assertRaises(sa.exc.OperationalError):
+            session.flush()
+
+
+    def test_sticky_after_group_commit(self):
+        from pyramid.response import Response
+        from .services.group_commit import GroupCommitter
+        from .views.blog import blog_create
+
+        committer = GroupCommitter(self.primary)
+        self.addCleanup(committer.close)
+        self.config.registry['group_commit'] = committer
+        request = self._request('/blog/create', 'blog_action', 'POST',
+                                post={'title': u'grouped', 'body': u'b'})
+        request.matchdict = {'action': 'create'}
+        request.dbsession = self.replicas.factory_for(request)()
+        self.addCleanup(request.dbsession.close)
+        self.assertEqual(blog_create(request).status_int, 302)
+        # the entry went through the committer's own session
+        self.assertFalse(request.dbsession.new)
+        response = Response()
+        request._process_response_callbacks(response)
+        self.assertIn('blogr_primary=1', response.headers['Set-Cookie'])
+
+class TestReadOnlyFastPath(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        import shutil
+        import tempfile
+        from pyramid.events import NewResponse
+        from webtest import TestApp
+        from . import main
+        from .models import get_engine
+        from .models.meta import Base
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        settings = {
+            'sqlalchemy.url': 'sqlite:///' + os.path.join(tmp, 'db.sqlite'),
+            'blogr.db.fast_path': 'true',
+            'blogr.hashing.backend': 'inline',
+        }
+        engine = get_engine(settings)
+        Base.metadata.create_all(engine)
+        engine.dispose()
+        app = main({}, **settings)
+        self.addCleanup(
+            app.registry['dbsession_factory'].kw['bind'].dispose)
+        self.requests = []
+        self.attempts = []
+        # pyramid_retry clears its environ keys once the request is done
+        app.registry.registerHandler(
+            lambda event: (
+                self.requests.append(event.request),
+                self.attempts.append(
+                    event.request.environ['retry.attempts'])),
+            (NewResponse,))
+        self.app = TestApp(app)
+
+    def test_safe_requests_skip_the_transaction(self):
+        from sqlalchemy.exc import InvalidRequestError
+        from .models.blog_record import BlogRecord
+        from .models.readonly import READ_ONLY_KEY
+
+        self.app.get('/', status=200)
+        request, = self.requests
+        self.assertTrue(request.environ['blogr.read_only'])
+        self.assertEqual(self.attempts, [1])
+        self.assertTrue(request.dbsession.info[READ_ONLY_KEY])
+        request.dbsession.add(BlogRecord(title=u'no', body=u'b'))
+        with self.assertRaises(InvalidRequestError):
+            request.dbsession.flush()
+
+    def test_stale_html_is_stored(self):
+        from .markup import RENDERER_VERSION
+        from .models.blog_record import BlogRecord
+
+        factory = self.app.app.registry['dbsession_factory']
+        session = factory()
+        self.addCleanup(session.close)
+        session.add(BlogRecord(title=u'one', body=u'*new*'))
+        session.commit()
+
+        response = self.app.get('/blog/1/one', status=200)
+        self.assertIn('<em>new</em>', response.text)
+        self.assertTrue(self.requests[0].environ['blogr.read_only'])
+        session.expire_all()
+        entry = session.get(BlogRecord, 1)
+        self.assertEqual(entry.body_html, u'<p><em>new</em></p>')
+        self.assertEqual(entry.body_html_version, RENDERER_VERSION)
+
+    def test_static_and_writes(self):
+        from .models.user import User
+
+        self.app.get('/static/pyramid.png', status=200)
+        self.app.post('/register', {'username': u'u', 'password': u'pwd'},
+                      status=302)
+        static, register = self.requests
+        self.assertTrue(static.environ['blogr.read_only'])
+        self.assertFalse(register.environ['blogr.read_only'])
+        self.assertEqual(self.attempts, [1, 3])
+        session = self.app.app.registry['dbsession_factory']()
+        self.addCleanup(session.close)
+        self.assertEqual(session.query(User).count(), 1)
+
+
+class TestQueryStats(BaseTest):
+
+    def setUp(self):
+        super(TestQueryStats, self).setUp()
+        self.init_database()
+        self.config.add_settings({'blogr.query_stats.server_timing': 'true'})
+
+    def test_tween_counts_request_statements(self):
+        from pyramid.request import Request
+        from pyramid.response import Response
+        from .models.user import User
+        from .querystats import query_stats_tween_factory
+
+        def handler(request):
+            self.session.query(User).count()
+            self.session.query(User).filter(User.name == u'x').first()
+            return Response('ok')
+
+        tween = query_stats_tween_factory(handler, self.config.registry)
+        request = Request.blank('/?a=1')
+        with self.assertLogs('pyramid_blogr.querystats', 'INFO') as logs:
+            response = tween(request)
+        message, = logs.output
+        self.assertIn('GET /?a=1: 2 queries in', message)
+        self.assertIn('slowest', message)
+        self.assertRegex(response.headers['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="2 queries", '
+                         r'db-slowest;dur=[\d.]+$')
+
+        # nothing is collected outside of requests
+        handler(request)
+        response = tween(Request.blank('/'))
+        self.assertIn('desc="2 queries"', response.headers['Server-Timing'])
+
+    def test_over_the_response_cache(self):
+        import os
+        import shutil
+        import tempfile
+        from webtest import TestApp
+        from . import main
+        from .models.meta import Base
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        app = main({}, **{
+            'sqlalchemy.url': 'sqlite:///' + os.path.join(tmp, 'db.sqlite'),
+            'blogr.hashing.backend': 'inline',
+            'blogr.response_cache.size': '10',
+            'blogr.query_stats': 'true',
+            'blogr.query_stats.server_timing': 'true',
+        })
+        engine = app.registry['dbsession_factory'].kw['bind']
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(engine)
+        app = TestApp(app)
+
+        with self.assertLogs('pyramid_blogr.querystats', 'INFO'):
+            miss = app.get('/', status=200)
+            hit = app.get('/', status=200)
+        self.assertEqual(miss.headers['X-Cache'], 'MISS')
+        self.assertNotIn('desc="0 queries"', miss.headers['Server-Timing'])
+        self.assertEqual(hit.headers['X-Cache'], 'HIT')
+        self.assertEqual(hit.headers.getall('Server-Timing'),
+                         ['db;dur=0.0;desc="0 queries"'])
+
+    def test_stats(self):
+        from .querystats import QueryStats
+
+        stats = QueryStats()
+        self.assertEqual(stats.server_timing(), 'db;dur=0.0;desc="0 queries"')
+        stats.record('SELECT 1', 0.002)
+        stats.record('SELECT 2', 0.005)
+        stats.record('SELECT 3', 0.001)
+        self.assertEqual((stats.count, stats.slowest), (3, 'SELECT 2'))
+        self.assertAlmostEqual(stats.elapsed, 0.008)
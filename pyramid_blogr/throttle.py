@@ -0,0 +1,133 @@
+"""
+Throttling of sign in attempts with token buckets.
+
+Every username and every client address gets a bucket holding up to
+``burst`` tokens, refilled at ``per_minute`` tokens a minute.  An attempt
+takes a token from both buckets and is turned away with ``429 Too Many
+Requests`` when either is empty - before the user is looked up or any
+password is hashed.
+
+Buckets live in a bounded :class:`TokenBuckets` store in the process by
+default.  Processes that should share their buckets can be given another
+store with ``blogr.throttle.store``: the dotted name of a callable which
+takes the settings and returns an object with the same ``take`` method.
+
+The client address is the peer address of the connection.  Behind a
+reverse proxy listed in ``blogr.throttle.trusted_proxies`` it is the last
+address of the ``X-Forwarded-For`` header that proxy sent instead; the
+header is ignored on requests coming from anywhere else, as any client can
+send it.
+
+"""
+import collections
+import threading
+import time
+
+from pyramid.path import DottedNameResolver
+from pyramid.settings import aslist
+
+
+class TokenBuckets(object):
+    """
+    A thread safe store of at most ``maxsize`` token buckets.
+
+    The least recently used bucket is dropped to make room for a new one;
+    a dropped bucket starts over full.
+
+    """
+
+    def __init__(self, maxsize=10000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, rate, burst):
+        """
+        Take a token from the bucket ``key``, which holds up to ``burst``
+        tokens and gains ``rate`` tokens a second.
+
+        Returns 0 if a token was taken, or else the seconds until one is
+        available.
+
+        """
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class LoginThrottle(object):
+    """
+    Limits sign in attempts per username and per client address.
+
+    """
+
+    def __init__(self, store, username_burst=5, username_per_minute=5,
+                 address_burst=20, address_per_minute=30,
+                 trusted_proxies=()):
+        self.store = store
+        self.trusted_proxies = frozenset(trusted_proxies)
+        self.username = (username_per_minute / 60.0, username_burst)
+        self.address = (address_per_minute / 60.0, address_burst)
+
+    def client_address(self, request):
+        """ Return the address ``request`` is throttled by. """
+        address = request.remote_addr
+        if address in self.trusted_proxies:
+            # the proxy appends the address it received the request from
+            forwarded = request.headers.get('X-Forwarded-For', '')
+            forwarded = forwarded.rsplit(',', 1)[-1].strip()
+            if forwarded:
+                address = forwarded
+        return address
+
+    def attempt(self, username, address):
+        """
+        Count a sign in attempt and return 0 if it may go ahead, or else
+        the seconds to wait before trying again.
+
+        """
+        wait = self.store.take(('address', address), *self.address)
+        if not wait:
+            wait = self.store.take(
+                ('username', username.strip().lower()), *self.username)
+        return wait
+
+
+def includeme(config):
+    """
+    Set up ``registry['login_throttle']`` from the ``blogr.throttle.*``
+    settings.
+
+    Activate this setup using ``config.include('pyramid_blogr.throttle')``.
+
+    """
+    settings = config.get_settings()
+    store = settings.get('blogr.throttle.store')
+    if store:
+        store = DottedNameResolver().maybe_resolve(store)(settings)
+    else:
+        store = TokenBuckets(int(settings.get('blogr.throttle.size', 10000)))
+    config.registry['login_throttle'] = LoginThrottle(
+        store,
+        username_burst=int(settings.get('blogr.throttle.username_burst', 5)),
+        username_per_minute=float(
+            settings.get('blogr.throttle.username_per_minute', 5)),
+        address_burst=int(settings.get('blogr.throttle.address_burst', 20)),
+        address_per_minute=float(
+            settings.get('blogr.throttle.address_per_minute', 30)),
+        trusted_proxies=aslist(
+            settings.get('blogr.throttle.trusted_proxies', '')))
@@ -1,6 +1,9 @@
 from pyramid.view import view_config
 from pyramid.httpexceptions import HTTPNotFound, HTTPFound
+from .. import conditional
+from ..markup import RENDERER_VERSION
 from ..models.blog_record import BlogRecord
+from ..models.replicas import WROTE_KEY
 from ..services.blog_record import BlogRecordService
 from ..forms import BlogCreateForm, BlogUpdateForm
 
@@ -9,9 +12,21 @@ from ..forms import BlogCreateForm, BlogUpdateForm
              renderer='pyramid_blogr:templates/view_blog.jinja2')
 def blog_view(request):
     blog_id = int(request.matchdict.get('id', -1))
+    if conditional.is_conditional(request):
+        # revalidate from the edited column before loading the whole entry
+        edited = BlogRecordService.last_edited(request, blog_id)
+        if edited is not None:
+            validators = conditional.make_validators(
+                edited, blog_id, RENDERER_VERSION)
+            if conditional.is_fresh(request, validators):
+                return conditional.not_modified(validators)
     entry = BlogRecordService.by_id(blog_id, request)
     if not entry:
         return HTTPNotFound()
+    BlogRecordService.render_stale(request, entry)
+    conditional.set_validators(
+        request.response,
+        conditional.make_validators(entry.edited, entry.id, RENDERER_VERSION))
     return {'entry': entry}
 
 
@@ -23,7 +38,15 @@ def blog_create(request):
     form = BlogCreateForm(request.POST)
     if request.method == 'POST' and form.validate():
         form.populate_obj(entry)
-        request.dbsession.add(entry)
+        entry.render_body()
+        committer = request.registry.get('group_commit')
+        if committer is not None:
+            # committed along with entries posted at the same time, by
+            # another session: keep this client reading from the primary
+            committer.insert(entry)
+            request.dbsession.info[WROTE_KEY] = True
+        else:
+            request.dbsession.add(entry)
         return HTTPFound(location=request.route_url('home'))
     return {'form': form, 'action': request.matchdict.get('action')}
 
@@ -40,6 +63,7 @@ def blog_update(request):
     if request.method == 'POST' and form.validate():
         del form.id  # SECURITY: prevent overwriting of primary key
         form.populate_obj(entry)
+        entry.render_body()
         return HTTPFound(
             location=request.route_url('blog', id=entry.id,slug=entry.slug))
     return {'form': form, 'action': request.matchdict.get('action')}
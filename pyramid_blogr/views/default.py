@@ -1,6 +1,9 @@
+import math
+
 from pyramid.view import view_config
-from pyramid.httpexceptions import HTTPFound
+from pyramid.httpexceptions import HTTPFound, HTTPTooManyRequests
 from pyramid.security import remember, forget
+from .. import conditional
 from ..services.user import UserService
 from ..services.blog_record import BlogRecordService
 from ..forms import RegistrationForm
@@ -10,9 +13,25 @@ from ..models.user import User
 @view_config(route_name='home',
              renderer='pyramid_blogr:templates/index.jinja2')
 def index_page(request):
-    page = int(request.params.get('page', 1))
-    paginator = BlogRecordService.get_paginator(request, page)
-    return {'paginator': paginator}
+    # the listing changes with any entry, and greets signed in users
+    listing = (BlogRecordService.last_edited(request),
+               BlogRecordService.count(request))
+    validators = conditional.make_validators(
+        *listing + (request.query_string, request.authenticated_userid))
+    if conditional.is_fresh(request, validators):
+        return conditional.not_modified(validators, vary=['Cookie'])
+    conditional.set_validators(request.response, validators, vary=['Cookie'])
+
+    if request.registry.settings.get('blogr.pagination') == 'keyset':
+        paginator = BlogRecordService.get_keyset_paginator(
+            request, after=request.params.get('after'),
+            before=request.params.get('before'))
+    else:
+        page = int(request.params.get('page', 1))
+        paginator = BlogRecordService.get_paginator(request, page)
+    # keys the cached listing, so that entries written by other processes
+    # show up without waiting for the fragment to expire
+    return {'paginator': paginator, 'listing': listing}
 
 
 @view_config(route_name='auth', match_param='action=in', renderer='string',
@@ -21,9 +40,22 @@ def index_page(request):
 def sign_in_out(request):
     username = request.POST.get('username')
     if username:
+        throttle = request.registry.get('login_throttle')
+        if throttle is not None:
+            wait = throttle.attempt(username,
+                                    throttle.client_address(request))
+            if wait:
+                response = HTTPTooManyRequests(
+                    'Too many sign in attempts, please wait a moment.')
+                response.retry_after = int(math.ceil(wait))
+                return response
         user = UserService.by_name(username, request=request)
-        if user and user.verify_password(request.POST.get('password')):
+        if user and user.verify_password(request.POST.get('password'),
+                                         request.password_hasher):
             headers = remember(request, user.name)
+            tracker = request.registry.get('last_login')
+            if tracker is not None:
+                tracker.record(user.id)
         else:
             headers = forget(request)
     else:
@@ -37,7 +69,8 @@ def register(request):
     form = RegistrationForm(request.POST)
     if request.method == 'POST' and form.validate():
         new_user = User(name=form.username.data)
-        new_user.set_password(form.password.data.encode('utf8'))
+        new_user.set_password(form.password.data.encode('utf8'),
+                              request.password_hasher)
         request.dbsession.add(new_user)
         return HTTPFound(location=request.route_url('home'))
     return {'form': form}
@@ -0,0 +1,18 @@
+from pyramid.response import Response
+from pyramid.view import view_config
+
+from ..services.export import FORMATS, export_entries
+
+
+@view_config(route_name='export', permission='export')
+def export_view(request):
+    format = request.matchdict['format']
+    # the dump is streamed after the request transaction is over, so it
+    # reads through a connection of its own
+    engine = request.dbsession.get_bind()
+    response = Response(app_iter=export_entries(engine, format))
+    response.content_type = FORMATS[format][1]
+    response.charset = 'utf-8'
+    response.content_disposition = 'attachment; filename="entries.%s"' % (
+        format)
+    return response
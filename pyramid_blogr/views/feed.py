@@ -0,0 +1,116 @@
+import datetime
+from xml.sax.saxutils import escape, quoteattr
+
+from pyramid.response import Response
+from pyramid.view import view_config
+
+from .. import conditional
+from ..services.blog_record import BlogRecordService
+
+ATOM_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _date(value):
+    return value.strftime(ATOM_DATE_FORMAT) if value else ''
+
+
+def atom_header(request, title, updated):
+    home = request.route_url('home')
+    return (
+        u'<?xml version="1.0" encoding="utf-8"?>\n'
+        u'<feed xmlns="http://www.w3.org/2005/Atom">\n'
+        u'  <title>%s</title>\n'
+        u'  <id>%s</id>\n'
+        u'  <link rel="self" href=%s/>\n'
+        u'  <link href=%s/>\n'
+        u'  <updated>%s</updated>\n'
+        u'  <author><name>%s</name></author>\n' % (
+            escape(title), escape(home), quoteattr(request.route_url('feed')),
+            quoteattr(home),
+            # required, even for a blog without entries
+            _date(updated or datetime.datetime.utcnow()), escape(title)))
+
+
+def atom_entry(request, entry):
+    url = request.route_url('blog', id=entry.id, slug=entry.slug)
+    if entry.body_html_stale:
+        # not rendered yet, the feed is read only
+        content_type, content = 'text', entry.body
+    else:
+        content_type, content = 'html', entry.body_html
+    return (
+        u'  <entry>\n'
+        u'    <title>%s</title>\n'
+        u'    <id>%s</id>\n'
+        u'    <link href=%s/>\n'
+        u'    <published>%s</published>\n'
+        u'    <updated>%s</updated>\n'
+        u'    <content type="%s">%s</content>\n'
+        u'  </entry>\n' % (
+            escape(entry.title), escape(url), quoteattr(url),
+            _date(entry.created), _date(entry.edited), content_type,
+            escape(content or u'')))
+
+
+def stream_feed(request, query, header, cache=None, generation=None,
+                validators=None, batch_size=50):
+    """
+    Yield the encoded feed one entry at a time.
+
+    Entries are read in batches through a session of their own, since the
+    request transaction is over by the time the server iterates over the
+    response.  The complete document is put in ``cache`` once it has been
+    sent out in full.
+
+    """
+    chunks = []
+
+    def emit(text):
+        chunk = text.encode('utf-8')
+        if cache is not None:
+            chunks.append(chunk)
+        return chunk
+
+    yield emit(header)
+    session = request.dbsession_factory()
+    try:
+        for entry in query.with_session(session).yield_per(batch_size):
+            yield emit(atom_entry(request, entry))
+    finally:
+        session.close()
+    yield emit(u'</feed>\n')
+
+    if cache is not None:
+        cache.set(request.application_url, (validators, b''.join(chunks)),
+                  generation=generation)
+
+
+@view_config(route_name='feed')
+def feed_view(request):
+    settings = request.registry.settings
+    cache = request.registry.get('feed_cache')
+
+    # other processes write entries without clearing this process' cache,
+    # so a cached feed is only good while it matches the entries
+    generation = cache.generation if cache is not None else None
+    updated = BlogRecordService.last_edited(request)
+    validators = conditional.make_validators(
+        updated, BlogRecordService.count(request))
+    if conditional.is_fresh(request, validators):
+        return conditional.not_modified(validators)
+
+    cached = cache.get(request.application_url) if cache is not None else None
+    if cached is not None and cached[0] == validators:
+        response = Response(body=cached[1])
+    else:
+        query = BlogRecordService.feed(
+            request, int(settings.get('blogr.feed.limit', 50)))
+        header = atom_header(
+            request, settings.get('blogr.feed.title', u'pyramid_blogr'),
+            updated)
+        response = Response(app_iter=stream_feed(
+            request, query, header, cache, generation, validators))
+
+    response.content_type = 'application/atom+xml'
+    response.charset = 'utf-8'
+    return conditional.set_validators(response, validators)
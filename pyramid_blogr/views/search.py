@@ -0,0 +1,12 @@
+from pyramid.view import view_config
+
+from ..services.blog_record import BlogRecordService
+
+
+@view_config(route_name='search',
+             renderer='pyramid_blogr:templates/search.jinja2')
+def search_view(request):
+    terms = request.params.get('q', u'').strip()
+    paginator = BlogRecordService.search(request, terms,
+                                         after=request.params.get('after'))
+    return {'terms': terms, 'paginator': paginator}
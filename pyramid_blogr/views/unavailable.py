@@ -0,0 +1,12 @@
+from pyramid.httpexceptions import HTTPServiceUnavailable
+from pyramid.view import exception_view_config
+
+from ..passwords import HashingBusy
+
+
+@exception_view_config(HashingBusy)
+def hashing_busy_view(request):
+    response = HTTPServiceUnavailable(
+        'Too many sign ins at once, please try again in a moment.')
+    response.retry_after = 1
+    return response
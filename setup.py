@@ -25,6 +25,7 @@ requires = [
     'paginate==0.5.6', # pagination helpers
     'paginate_sqlalchemy==0.3.0',
     'passlib',
+    'markdown',  # entry bodies
 ]
 
 tests_require = [
@@ -61,6 +62,12 @@ setup(
         ],
         'console_scripts': [
             'initialize_pyramid_blogr_db=pyramid_blogr.scripts.initialize_db:main',
+            'blogr_export=pyramid_blogr.scripts.export:main',
+            'blogr_import=pyramid_blogr.scripts.import_entries:main',
+            'blogr_rerender=pyramid_blogr.scripts.rerender:main',
+            'blogr_hash_passwords=pyramid_blogr.scripts.hash_passwords:main',
+            'blogr_calibrate_hashing='
+            'pyramid_blogr.scripts.calibrate_hashing:main',
         ],
     },
 )